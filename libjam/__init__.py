@@ -5,9 +5,33 @@ Docs: https://libjam.readthedocs.io
 PyPi: https://pypi.org/project/libjam
 """
 
-from .captain import Captain
-from .secretary import Secretary
-from . import writer
-from . import flashcard
-from . import drawer
-from .path import Path
+# Submodules are only imported when they're first accessed, so that
+# programs don't pay for the dependencies of the ones they don't use.
+# Lazily loaded names: `name: (module, attribute or None for the module)`
+_lazy_names = {
+  'Captain': ('.captain', 'Captain'),
+  'Secretary': ('.secretary', 'Secretary'),
+  'writer': ('.writer', None),
+  'flashcard': ('.flashcard', None),
+  'drawer': ('.drawer', None),
+  'courier': ('.courier', None),
+  'Path': ('.path', 'Path'),
+}
+
+__all__ = list(_lazy_names)
+
+
+def __getattr__(name: str):
+  if name not in _lazy_names:
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+  import importlib
+  module_name, attribute = _lazy_names[name]
+  value = importlib.import_module(module_name, __name__)
+  if attribute is not None:
+    value = getattr(value, attribute)
+  globals()[name] = value
+  return value
+
+
+def __dir__() -> list[str]:
+  return sorted(set(globals()) | set(_lazy_names))
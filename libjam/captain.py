@@ -1,6 +1,8 @@
 # Imports
 import os
 import sys
+import types
+import functools
 
 # Internal imports
 from . import writer
@@ -20,11 +22,14 @@ def _get_class_commands(cls) -> dict[str: callable]:
   return commands
 
 
+@functools.cache
 def _get_function_args(
   function: callable,
-) -> tuple[list[str], list[str], str|None]:
+) -> tuple[tuple[str, ...], tuple[str, ...], str|None]:
   """Returns parameters a given function accepts.
 
+  The result is cached, which is why it's immutable.
+
   Return tuple format: `(required, optional, arbitary)`.
   """
   code = function.__code__
@@ -32,7 +37,7 @@ def _get_function_args(
     raise NotImplementedError(
       'Keyword-only function arguments are not supported.'
     )
-  varnames = list(code.co_varnames)
+  varnames = code.co_varnames
   argcount = code.co_argcount
   n_optional_args = len(function.__defaults__ or [])
   n_required_args = argcount - n_optional_args
@@ -97,11 +102,222 @@ def _dict_to_table(d: dict[str: str|None]) -> str:
   return writer.to_columns(items, 2, '', '')
 
 
+def _make_option(key: str, flags: list, desc: str) -> dict:
+  """Creates an option, see `Captain.add_option`."""
+  if not flags:
+    flags = [key]
+  long_flags = []
+  short_flags = []
+  for flag in flags:
+    if len(flag) == 1:
+      short_flags.append(flag)
+    else:
+      long_flags.append(flag)
+  return {
+    'key': key,
+    'long': long_flags,
+    'short': short_flags,
+    'desc': desc,
+  }
+
+
+def _get_summary(text: str | None) -> str:
+  """Returns the first line of the given docstring."""
+  return (text or '').strip().split('\n')[0]
+
+
+def _to_identifier(name: str) -> str:
+  return ''.join(char if char.isalnum() else '_' for char in name)
+
+
+def _bash_completion(
+  program: str,
+  commands: dict[str, str],
+  options: list[tuple[list[str], str]],
+) -> str:
+  """Returns a bash completion script."""
+  import shlex
+  function = '_' + _to_identifier(program)
+  flags = [flag for option_flags, _ in options for flag in option_flags]
+  return (
+    f'{function}() {{\n'
+    '  local cur="${COMP_WORDS[COMP_CWORD]}"\n'
+    f"  local commands={shlex.quote(' '.join(commands))}\n"
+    f"  local options={shlex.quote(' '.join(flags))}\n"
+    '  if [[ "$cur" == -* ]]; then\n'
+    '    COMPREPLY=($(compgen -W "$options" -- "$cur"))\n'
+    '    return\n'
+    '  fi\n'
+    '  if [[ -n "$commands" ]]; then\n'
+    '    local word\n'
+    '    for word in "${COMP_WORDS[@]:1:COMP_CWORD-1}"; do\n'
+    '      if [[ "$word" != -* ]]; then\n'
+    '        COMPREPLY=($(compgen -f -- "$cur"))\n'
+    '        return\n'
+    '      fi\n'
+    '    done\n'
+    '    COMPREPLY=($(compgen -W "$commands" -- "$cur"))\n'
+    '    return\n'
+    '  fi\n'
+    '  COMPREPLY=($(compgen -f -- "$cur"))\n'
+    '}\n'
+    f'complete -o filenames -F {function} {shlex.quote(program)}\n'
+  )
+
+
+def _zsh_completion(
+  program: str,
+  commands: dict[str, str],
+  options: list[tuple[list[str], str]],
+) -> str:
+  """Returns a zsh completion script."""
+  def quote(text: str) -> str:
+    return "'" + text.replace("'", "'\\''") + "'"
+
+  def escape(text: str) -> str:
+    for char in '\\[]:':
+      text = text.replace(char, '\\' + char)
+    return text
+
+  function = '_' + _to_identifier(program)
+  specs = []
+  for flags, desc in options:
+    group = '(' + ' '.join(flags) + ')' if len(flags) > 1 else ''
+    for flag in flags:
+      specs.append(quote(f'{group}{flag}[{escape(desc)}]'))
+  if commands:
+    specs.append(quote('1:command:->command'))
+    specs.append(quote('*::file:_files'))
+  else:
+    specs.append(quote('*:file:_files'))
+  lines = [
+    f'#compdef {program}',
+    f'{function}() {{',
+    '  local state',
+    '  local -a commands',
+    '  commands=(',
+    *(
+      '    ' + quote(f'{escape(command)}:{desc}')
+      for command, desc in commands.items()
+    ),
+    '  )',
+    '  _arguments -s \\',
+    *(f'    {spec} \\' for spec in specs[:-1]),
+    f'    {specs[-1]}',
+    '  if [[ "$state" == command ]]; then',
+    "    _describe 'command' commands",
+    '  fi',
+    '}',
+    f'if [[ "$funcstack[1]" == {function} ]]; then',
+    f'  {function} "$@"',
+    'else',
+    f'  compdef {function} {program}',
+    'fi',
+  ]
+  return '\n'.join(lines) + '\n'
+
+
+def _fish_completion(
+  program: str,
+  commands: dict[str, str],
+  options: list[tuple[list[str], str]],
+) -> str:
+  """Returns a fish completion script."""
+  def quote(text: str) -> str:
+    return "'" + text.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+  complete = f'complete -c {quote(program)}'
+  lines = []
+  if commands:
+    lines.append(f'{complete} -n __fish_use_subcommand -f')
+    for command, desc in commands.items():
+      lines.append(
+        f'{complete} -n __fish_use_subcommand -a {quote(command)} '
+        f'-d {quote(desc)}'
+      )
+  for flags, desc in options:
+    args = []
+    for flag in flags:
+      if flag.startswith('--'):
+        args.append('-l ' + quote(flag.removeprefix('--')))
+      else:
+        args.append('-s ' + quote(flag.removeprefix('-')))
+    lines.append(f"{complete} {' '.join(args)} -d {quote(desc)}")
+  return '\n'.join(lines) + '\n'
+
+
+_completion_generators = {
+  'bash': _bash_completion,
+  'zsh': _zsh_completion,
+  'fish': _fish_completion,
+}
+
+
+def _read_records(fp, separator: str):
+  """Yields records from the given text stream, which are terminated by
+  the given separator or by the end of the stream.
+  """
+  if separator == '\n':
+    for line in fp:
+      yield line.removesuffix('\n')
+    return
+  record = []
+  # Reading by character, so that records are handled as they arrive
+  while char := fp.read(1):
+    if char == separator:
+      yield ''.join(record)
+      record = []
+    else:
+      record.append(char)
+  if record:
+    yield ''.join(record)
+
+
+def _to_exit_status(code) -> int:
+  """Returns the exit status of a `SystemExit` with the given code."""
+  if code is None:
+    return 0
+  if isinstance(code, int):
+    return code
+  print(code, file=sys.stderr)
+  return 1
+
+
+class _LazyCommand:
+  """A command whose function is only imported when it's run."""
+  __slots__ = ('_function', 'desc', 'target', 'usage')
+
+  def __init__(self, target, desc: str, usage: str):
+    self.target = target
+    self.desc = desc
+    self.usage = usage
+    self._function = None
+
+  def load(self) -> callable:
+    """Imports and returns the command's function."""
+    if self._function is not None:
+      return self._function
+    if isinstance(self.target, str):
+      import importlib
+      module_name, _, attributes = self.target.partition(':')
+      function = importlib.import_module(module_name)
+      for attribute in filter(None, attributes.split('.')):
+        function = getattr(function, attribute)
+    else:
+      # An `importlib.metadata.EntryPoint`
+      function = self.target.load()
+    self._function = function
+    return function
+
+
 class Captain:
   """Creates a CLI around a given function or object.
 
   If the `program` is not specified, then `sys.argv[0]` will be used to
   determine the name of the program.
+
+  The `ship` can also be None, if all of the commands are added using
+  the `add_command` method.
   """
   def __init__(
     self,
@@ -111,8 +327,6 @@ class Captain:
     add_help: bool = True,
     compact_help: bool = None,
   ):
-    if type(ship) is type:
-      raise ValueError(f"Specified ship '{ship.__name__}' is not initialised")
     self.ship = ship
     self.add_help = add_help
     self.compact_help = compact_help
@@ -120,6 +334,50 @@ class Captain:
       program = os.path.basename(sys.argv[0])
     self.program = program
     self.options = []
+    self._lazy_commands = {}
+    self._help_option = _make_option('help', ['help', 'h'], 'Prints this page')
+
+  @property
+  def ship(self) -> object or callable:
+    """The function or object the CLI is created around."""
+    return self._ship
+
+  @ship.setter
+  def ship(self, ship: object or callable):
+    if type(ship) is type:
+      raise ValueError(f"Specified ship '{ship.__name__}' is not initialised")
+    self._ship = ship
+    self._index = None
+
+  def _get_options(self) -> list[dict]:
+    """Returns all options, with the help option last."""
+    if self.add_help:
+      return self.options + [self._help_option]
+    return self.options
+
+  def _get_index(self) -> types.MappingProxyType:
+    """Returns the index of commands and option flags, which is built on
+    first use and rebuilt after the ship is changed or options are added.
+    """
+    index = self._index
+    if index is not None and index['add_help'] == self.add_help:
+      return index
+    flags = {'long': {}, 'short': {}}
+    for option in self._get_options():
+      for flag_type, flag_index in flags.items():
+        for flag in option.get(flag_type):
+          flag_index.setdefault(flag, option)
+    commands = {}
+    if self.ship is not None and not callable(self.ship):
+      commands = _get_class_commands(type(self.ship))
+    commands.update(self._lazy_commands)
+    self._index = types.MappingProxyType({
+      'long': types.MappingProxyType(flags['long']),
+      'short': types.MappingProxyType(flags['short']),
+      'commands': types.MappingProxyType(commands),
+      'add_help': self.add_help,
+    })
+    return self._index
 
   def add_option(self, key: str, flags: list = [], desc: str = ''):
     """Adds an option to the CLI.
@@ -131,42 +389,90 @@ class Captain:
     `key` will lead to either True (if one of the flags was provided by
     the user) or False (if the user did not specify the option's flag).
     """
-    if not flags:
-      flags = [key]
-    long_flags = []
-    short_flags = []
-    for flag in flags:
-      if len(flag) == 1:
-        short_flags.append(flag)
+    self.options.append(_make_option(key, flags, desc))
+    self._index = None
+
+  def add_command(
+    self,
+    name: str,
+    target,
+    desc: str = '',
+    usage: str = None,
+  ):
+    """Adds a command that's only imported when it's run, so that the
+    CLI doesn't have to import the dependencies of all of its commands.
+
+    The `target` is either an import path, like `'package.module:function'`,
+    or an `importlib.metadata.EntryPoint`. When parsing, the target is
+    imported and returned as the chosen function, and, unlike the ship's
+    methods, it's not given the ship as its first argument.
+
+    The `desc` and `usage`, like `'<SRC> [DST]'`, are shown on the help
+    page, so that the target doesn't have to be imported to print it.
+
+    Usage example:
+    ```
+    captain = Captain(None, 'tool')
+    captain.add_command('sync', 'tool.sync:main', 'Syncs files')
+    for entry_point in importlib.metadata.entry_points(group='tool'):
+      captain.add_command(entry_point.name, entry_point)
+    function, args = captain.parse()
+    function(*args)
+    ```
+
+    If the ship is a function rather than an object, `TypeError` is
+    raised.
+    """
+    if callable(self.ship):
+      raise TypeError('Commands can only be added to object ships')
+    self._lazy_commands[name] = _LazyCommand(target, desc, usage)
+    self._index = None
+
+  def get_completion(self, shell: str) -> str:
+    """Returns a completion script for the given shell, which can be
+    `'bash'`, `'zsh'` or `'fish'`.
+
+    The script completes commands, options and file names without
+    running the program. If `add_help` is true, then it's also printed
+    by the hidden `--completion SHELL` option, so that users can, for
+    example, add `source <(program --completion bash)` to their shell's
+    configuration.
+    """
+    generator = _completion_generators.get(shell)
+    if generator is None:
+      shells = ', '.join(_completion_generators)
+      raise ValueError(
+        f"Unsupported shell '{shell}', supported shells: {shells}"
+      )
+    commands = {}
+    for command, function in self._get_index()['commands'].items():
+      if isinstance(function, _LazyCommand):
+        commands[command] = _get_summary(function.desc)
       else:
-        long_flags.append(flag)
-    option = {
-      'key': key,
-      'long': long_flags,
-      'short': short_flags,
-      'desc': desc,
-    }
-    self.options.append(option)
+        commands[command] = _get_summary(function.__doc__)
+    options = []
+    for option in self._get_options():
+      flags = ['-' + flag for flag in option.get('short')]
+      flags += ['--' + flag for flag in option.get('long')]
+      options.append((flags, _get_summary(option.get('desc'))))
+    return generator(self.program, commands, options)
 
   def _parse_options(
     self,
     long_opts: list[str],
     short_opts: list[str],
   ) -> dict[str: bool]:
+    index = self._get_index()
     parsed_options = {}
-    for option in self.options:
+    for option in self._get_options():
       parsed_options[option.get('key')] = False
     for prefix, flag_type, given_opts in (
       ('--', 'long', long_opts),
       ('-', 'short', short_opts),
     ):
+      flags = index[flag_type]
       for given_opt in given_opts:
-        found = None
-        for option in self.options:
-          flags = option.get(flag_type)
-          if given_opt in flags:
-            found = option
-            break
+        found = flags.get(given_opt)
         if found is None:
           self.on_usage_error(f"unrecognised option '{prefix}{given_opt}'")
         else:
@@ -188,11 +494,20 @@ class Captain:
     options were added then the tuple will look like this
     `(function: callable, funtion_args: list, options: dict)`.
     """
+    # Printing the completion script if requested
+    if self.add_help and args[:1] == ['--completion']:
+      if len(args) != 2:
+        self.on_usage_error("option '--completion' requires a shell name")
+      try:
+        completion = self.get_completion(args[1])
+      except ValueError as error:
+        self.on_usage_error(str(error))
+      sys.stdout.write(completion)
+      exit_code = getattr(os, 'EX_OK', 0)
+      sys.exit(exit_code)
     # Categorising args
     args, long_opts, short_opts = _classify_args(args)
     # Parsing options and printing help if needed
-    if self.add_help:
-      self.add_option('help', ['help', 'h'], 'Prints this page')
     parsed_options = self._parse_options(long_opts, short_opts)
     if self.add_help:
       if parsed_options.get('help'):
@@ -211,7 +526,7 @@ class Captain:
           'no command specified.\n'
           f"Try '{self.program} --help' to view available commands."
         )
-      commands = _get_class_commands(type(self.ship))
+      commands = self._get_index()['commands']
       command = args.pop(0)
       function = commands.get(command)
       if not function:
@@ -220,11 +535,14 @@ class Captain:
           f"command '{command}' not recognised.\n"
           f'Available commands: {available_commands}'
         )
+    lazy = isinstance(function, _LazyCommand)
+    if lazy:
+      function = function.load()
     # Checking arguments
     required_args, optional_args, arbitrary_arg = _get_function_args(function)
     n_required_args = len(required_args)
     n_optional_args = len(optional_args)
-    if not ship_callable:
+    if not ship_callable and not lazy:
       if not required_args:
         function_name = function.__name__
         class_name = type(self.ship).__name__
@@ -250,6 +568,88 @@ class Captain:
       return return_list[0]
     return tuple(return_list)
 
+  def _dispatch(self, parsed):
+    """Runs the function chosen by `parse` with the parsed arguments.
+
+    What the function returns is ignored, so that commands returning
+    values, like counts, don't produce exit statuses.
+    """
+    if callable(self.ship):
+      function = self.ship
+      args = parsed[0] if self.options else parsed
+    else:
+      function, args = parsed[:2]
+    function(*args)
+
+  def serve(
+    self,
+    dispatch: callable = None,
+    stdin=None,
+    stdout=None,
+    separator: str = '\n',
+  ):
+    """Runs commands read from `stdin` in this process, one after
+    another, so that the program's startup cost is only paid once.
+
+    Each record of `stdin`, separated by `separator`, is split into
+    arguments like a shell would, then parsed using `parse` and passed to
+    `dispatch`. If `dispatch` is not specified, then the chosen function
+    is called with the parsed arguments. Options have to be handled by
+    a custom `dispatch`, which receives the tuple returned by `parse`.
+
+    Anything the command prints, including errors, is written to
+    `stdout`, followed by a status line: the ASCII record separator
+    character `\\x1e`, the exit status, and `separator`. The exit status
+    is the code of a `SystemExit` raised by the command, 1 if an
+    exception was raised, or 0 otherwise. A custom `dispatch` can also
+    return an integer to use it as the exit status, while the default one
+    ignores what commands return.
+
+    The `stdin` and `stdout` default to `sys.stdin` and `sys.stdout`,
+    and can be any text streams, for example a socket's `makefile`.
+    Returns once the end of `stdin` is reached.
+
+    Usage example:
+    ```
+    captain = Captain(Tool(), 'tool')
+    if sys.argv[1:] == ['--batch']:
+      # printf 'copy a b\\ncopy c d\\n' | tool --batch
+      captain.serve()
+    ```
+    """
+    import contextlib
+    import shlex
+    import traceback
+    if stdin is None:
+      stdin = sys.stdin
+    if stdout is None:
+      stdout = sys.stdout
+    if dispatch is None:
+      dispatch = self._dispatch
+    for record in _read_records(stdin, separator):
+      if not record.strip():
+        continue
+      with (
+        contextlib.redirect_stdout(stdout),
+        contextlib.redirect_stderr(stdout),
+      ):
+        try:
+          try:
+            args = shlex.split(record)
+          except ValueError as error:
+            self.on_usage_error(f'{error}.')
+          status = dispatch(self.parse(args))
+          # Only integers returned by a custom `dispatch` are statuses
+          if not isinstance(status, int):
+            status = 0
+        except SystemExit as error:
+          status = _to_exit_status(error.code)
+        except Exception:
+          traceback.print_exc()
+          status = 1
+      stdout.write(f'\x1e{status}{separator}')
+      stdout.flush()
+
   def print_help(self):
     """Prints the help page."""
     compact = self.compact_help
@@ -258,7 +658,9 @@ class Captain:
       compact = True if ship_callable else False
     section_separator = '\n' if compact else '\n\n'
     sections: list[tuple[str|None, str]] = []
-    description = self.ship.__doc__
+    description = None
+    if self.ship is not None:
+      description = self.ship.__doc__
     if ship_callable:
       # Adding usage
       usage = self.program + ' [OPTION]...'
@@ -275,17 +677,27 @@ class Captain:
       synopsys = self.program + ' [OPTION]... COMMAND [ARGS]...'
       sections.append(('Synopsis', synopsys))
       # Adding commands
-      commands = _get_class_commands(type(self.ship))
+      commands = self._get_index()['commands']
       commands_table = {}
       for command, function in commands.items():
-        commands_table[command] = function.__doc__
+        if isinstance(function, _LazyCommand):
+          commands_table[command] = function.desc
+        else:
+          commands_table[command] = function.__doc__
       commands_table = _dict_to_table(commands_table)
       sections.append(('Commands', commands_table))
       # Adding usage
       usage = []
       for command, function in commands.items():
-        args = _get_function_args(function)
-        args[0].pop(0) # Removing the `self` argument
+        if isinstance(function, _LazyCommand):
+          if function.usage:
+            usage.append(f'{self.program} {command} {function.usage}')
+          continue
+        required_args, optional_args, arbitrary_arg = (
+          _get_function_args(function)
+        )
+        # Removing the `self` argument
+        args = (required_args[1:], optional_args, arbitrary_arg)
         if not any(args):
           continue
         args = _to_posix_args(*args)
@@ -294,7 +706,7 @@ class Captain:
       sections.append(('Usage', usage))
     # Adding options
     options = {}
-    for option in self.options:
+    for option in self._get_options():
       long_flags = ['--' + flag for flag in option.get('long')]
       short_flags = ['-' + flag for flag in option.get('short')]
       flags = ', '.join(short_flags + long_flags)
@@ -0,0 +1,197 @@
+"""Runs `drawer`'s file operations from asyncio event loops."""
+
+# Imports
+import asyncio
+import contextlib
+import functools
+import threading
+
+# Internal imports
+from . import drawer
+
+
+class _Cancelled(Exception):
+  """Raised inside of a worker thread to stop a cancelled operation."""
+
+
+class Job:
+  """A `drawer` operation running in a worker thread.
+
+  Awaiting a job returns the result of the operation. Iterating over a
+  job with `async for` yields `(done, todo)` progress tuples until the
+  operation is finished. Progress updates are coalesced, so a slow
+  consumer only ever sees the latest progress.
+
+  If the awaiting task is cancelled, or `cancel` is called, then the
+  operation is stopped on its next progress update. Operations that do
+  not report progress can not be stopped, they are left to finish in
+  the background. Neither can 7zip archives be stopped while they are
+  being unpacked, since py7zr reports progress from a separate thread,
+  so cancelling such a job waits for unpacking to finish.
+  """
+
+  def __init__(
+    self,
+    function: callable,
+    args: tuple,
+    kwargs: dict,
+    semaphore: asyncio.Semaphore = None,
+    with_progress: bool = True,
+  ):
+    self._loop = asyncio.get_running_loop()
+    self._progress = None
+    self._changed = asyncio.Event()
+    self._notifying = False
+    self._cancelled = threading.Event()
+    self._with_progress = with_progress
+    if with_progress:
+      args = (*args, self._progress_callback)
+    call = functools.partial(function, *args, **kwargs)
+    self._task = self._loop.create_task(self._run(call, semaphore))
+
+  def _progress_callback(self, done: int, todo: int):
+    # Called from the worker thread
+    if self._cancelled.is_set():
+      raise _Cancelled()
+    self._progress = done, todo
+    if not self._notifying:
+      self._notifying = True
+      self._loop.call_soon_threadsafe(self._notify)
+
+  def _notify(self):
+    self._notifying = False
+    self._changed.set()
+
+  async def _run(self, call: callable, semaphore: asyncio.Semaphore):
+    try:
+      if semaphore is None:
+        return await self._run_in_thread(call)
+      async with semaphore:
+        return await self._run_in_thread(call)
+    finally:
+      self._changed.set()
+
+  async def _run_in_thread(self, call: callable):
+    future = self._loop.run_in_executor(None, call)
+    try:
+      return await asyncio.shield(future)
+    except asyncio.CancelledError:
+      self._cancelled.set()
+      if self._with_progress:
+        # Waiting for the operation to actually stop
+        with contextlib.suppress(_Cancelled):
+          await future
+      raise
+
+  @property
+  def progress(self) -> tuple[int, int] | None:
+    """The latest `(done, todo)` progress, or None if there is none."""
+    return self._progress
+
+  def done(self) -> bool:
+    """Returns whether the operation is finished."""
+    return self._task.done()
+
+  def cancel(self):
+    """Cancels the operation."""
+    self._cancelled.set()
+    self._task.cancel()
+
+  def __await__(self):
+    return self._task.__await__()
+
+  def __aiter__(self):
+    return self._iterate()
+
+  async def _iterate(self):
+    last = None
+    while True:
+      progress = self._progress
+      if progress is not None and progress != last:
+        last = progress
+        yield progress
+      if self._task.done():
+        break
+      self._changed.clear()
+      await self._changed.wait()
+
+
+class Courier:
+  """Runs `drawer`'s file operations in worker threads, at most
+  `max_jobs` at a time, so that they can be used from asyncio event
+  loops without blocking them.
+
+  Every method returns a `Job`, which can be awaited and iterated over
+  to get progress. Methods have to be called from a running event loop.
+
+  Usage example:
+  ```
+  courier = Courier(max_jobs=8)
+  job = courier.copy_tree_with_progress(src, dst)
+  async for done, todo in job:
+    print(f'{done}/{todo}')
+  await job
+  ```
+  """
+
+  def __init__(self, max_jobs: int = 4):
+    self.max_jobs = max_jobs
+    self._semaphore = asyncio.Semaphore(max_jobs)
+
+  def _job(self, function: callable, *args, with_progress=True, **kwargs):
+    return Job(function, args, kwargs, self._semaphore, with_progress)
+
+  def copy_with_progress(self, src, dst, **kwargs) -> Job:
+    """Copies the given file, see `drawer.copy_with_progress`."""
+    return self._job(drawer.copy_with_progress, src, dst, **kwargs)
+
+  def copy_tree_with_progress(self, src, dst, **kwargs) -> Job:
+    """Copies the given directory, see `drawer.copy_tree_with_progress`."""
+    return self._job(drawer.copy_tree_with_progress, src, dst, **kwargs)
+
+  def unlink_tree_with_progress(self, directory, **kwargs) -> Job:
+    """Deletes the given directory, see
+    `drawer.unlink_tree_with_progress`.
+    """
+    return self._job(drawer.unlink_tree_with_progress, directory, **kwargs)
+
+  def get_tree_size(self, directory, **kwargs) -> Job:
+    """Gets the size of the given directory, see `drawer.get_tree_size`.
+
+    This job does not report progress and can not be stopped once it
+    has started.
+    """
+    return self._job(
+      drawer.get_tree_size, directory, with_progress=False, **kwargs,
+    )
+
+  def unpack_with_progress(self, src, dst, **kwargs) -> Job:
+    """Unpacks the given archive, see `drawer.unpack_with_progress`."""
+    return self._job(drawer.unpack_with_progress, src, dst, **kwargs)
+
+  def unpack_zip_with_progress(self, src, dst, **kwargs) -> Job:
+    """Unpacks the given zip archive, see
+    `drawer.unpack_zip_with_progress`.
+    """
+    return self._job(drawer.unpack_zip_with_progress, src, dst, **kwargs)
+
+  def unpack_7z_with_progress(self, src, dst, **kwargs) -> Job:
+    """Unpacks the given 7zip archive, see
+    `drawer.unpack_7z_with_progress`.
+
+    This job can not be stopped once unpacking has started, the same
+    goes for 7zip archives unpacked by `unpack_with_progress`.
+    """
+    return self._job(drawer.unpack_7z_with_progress, src, dst, **kwargs)
+
+  def unpack_rar_with_progress(self, src, dst, **kwargs) -> Job:
+    """Unpacks the given rar archive, see
+    `drawer.unpack_rar_with_progress`.
+    """
+    return self._job(drawer.unpack_rar_with_progress, src, dst, **kwargs)
+
+  def unpack_tar_with_progress(self, src, dst, **kwargs) -> Job:
+    """Unpacks the given tar archive, see
+    `drawer.unpack_tar_with_progress`.
+    """
+    return self._job(drawer.unpack_tar_with_progress, src, dst, **kwargs)
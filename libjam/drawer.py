@@ -4,83 +4,1274 @@
 import os
 import sys
 import math
+import time
+import errno
 import shutil
-import filetype
-import subprocess
+import functools
+import contextlib
 
 
-def _statdir(directory) -> tuple[list[tuple[os.DirEntry, bool, int]], int]:
-  total_size = 0
-  items = []
-  for entry in os.scandir(directory):
-    size = entry.stat().st_size
-    total_size += size
-    is_dir = entry.is_dir()
-    info = entry, is_dir, size
-    items.append(info)
-    if is_dir:
-      pair = _statdir(entry)
-      items.extend(pair[0])
-      total_size += pair[1]
-  return items, total_size
-
-
-def copy_with_progress(src, dst, progress_callback: callable):
-  """Copies the given file while providing current progress."""
+class ThrottledCallback:
+  """Wraps a progress callback, coalescing updates so that it's called
+  at most once per `interval` seconds or once per `min_delta` units of
+  progress, whichever comes first.
+
+  The first update is always delivered. Whether an update is the final
+  one can't be told from `done` and `todo`, since unknown totals are
+  reported as 0, so the last skipped update is delivered by `flush`,
+  which is called on exiting the context manager.
+
+  Instances can be passed to any of the `*_with_progress` functions.
+
+  Usage example:
+  ```
+  with (
+    ProgressBar('Copying') as bar,
+    ThrottledCallback(bar.update, interval=1/30) as callback,
+  ):
+    copy_tree_with_progress(src, dst, callback)
+  ```
+  """
+
+  def __init__(
+    self,
+    progress_callback: callable,
+    interval: float = 0.1,
+    min_delta: int = None,
+  ):
+    self.progress_callback = progress_callback
+    self.interval = interval
+    self.min_delta = min_delta
+    self._last_time = None
+    self._last_done = 0
+    self._pending = None
+
+  def _deliver(self, done: int, todo: int, now: float):
+    self._last_time = now
+    self._last_done = done
+    self._pending = None
+    self.progress_callback(done, todo)
+
+  def __call__(self, done: int, todo: int):
+    now = time.monotonic()
+    unthrottled = self.interval is None and self.min_delta is None
+    if self._last_time is None or unthrottled:
+      deliver = True
+    else:
+      deliver = (
+        self.interval is not None
+        and now - self._last_time >= self.interval
+      ) or (
+        self.min_delta is not None
+        and done - self._last_done >= self.min_delta
+      )
+    if deliver:
+      self._deliver(done, todo, now)
+    else:
+      self._pending = done, todo
+
+  def flush(self):
+    """Delivers the last skipped update, if there is one."""
+    if self._pending is not None:
+      self._deliver(*self._pending, time.monotonic())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.flush()
+
+
+class _TreeEntry:
+  """A file or directory found by `_scantree`."""
+  __slots__ = ('is_dir', 'path', 'size')
+
+  def __init__(self, path: str, is_dir: bool, size: int):
+    self.path = path
+    self.is_dir = is_dir
+    self.size = size
+
+
+def _scantree(
+  directory,
+  topdown: bool = True,
+  follow_symlinks: bool = True,
+  ignore_errors: bool = False,
+):
+  """Iteratively walks the given directory, yielding a `_TreeEntry` for
+  every file and directory inside of it.
+
+  If `topdown` is true, then directories are yielded before their
+  contents, otherwise they are yielded after them.
+
+  Only the `stat` results cached by `os.DirEntry` are used, meaning that
+  on most platforms it takes a single syscall per entry.
+  """
+  stack = [(None, os.scandir(directory))]
+  try:
+    while stack:
+      parent, iterator = stack[-1]
+      try:
+        entry = next(iterator, None)
+      except OSError:
+        if not ignore_errors:
+          raise
+        entry = None
+      if entry is None:
+        iterator.close()
+        stack.pop()
+        if parent is not None and not topdown:
+          yield parent
+        continue
+      try:
+        size = entry.stat(follow_symlinks=follow_symlinks).st_size
+        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+      except OSError:
+        if not ignore_errors:
+          raise
+        continue
+      record = _TreeEntry(entry.path, is_dir, size)
+      if not is_dir:
+        yield record
+        continue
+      if topdown:
+        yield record
+      try:
+        stack.append((record, os.scandir(entry.path)))
+      except OSError:
+        if not ignore_errors:
+          raise
+  finally:
+    for _, iterator in stack:
+      iterator.close()
+
+
+class _TreeCounter:
+  """Totals the size of a tree in a background thread, so that work on
+  the tree can start before the total is known.
+
+  Until counting is finished, the total is not known, and `total`
+  returns 0.
+  """
+
+  def __init__(self, directory, follow_symlinks: bool = True):
+    import threading
+    self.size = 0
+    self.finished = False
+    self._stopped = False
+    self._thread = threading.Thread(
+      target=self._count,
+      args=(directory, follow_symlinks),
+      daemon=True,
+    )
+
+  def _count(self, directory, follow_symlinks: bool):
+    entries = _scantree(
+      directory,
+      follow_symlinks=follow_symlinks,
+      ignore_errors=True,
+    )
+    for entry in entries:
+      if self._stopped:
+        return
+      self.size += entry.size
+    self.finished = True
+
+  def total(self) -> int:
+    """Returns the counted size, or 0 if counting isn't finished."""
+    return self.size if self.finished else 0
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self._stopped = True
+    self._thread.join()
+
+
+# Kernel-side copying is only attempted on Linux, where both
+# `os.copy_file_range` and `os.sendfile` can write to regular files.
+_KERNEL_COPY_BUFSIZE = 8 * 1024 * 1024
+_KERNEL_COPY_ERRNOS = {
+  errno.EXDEV,
+  errno.ENOSYS,
+  errno.EINVAL,
+  errno.EBADF,
+  errno.EPERM,
+  errno.ETXTBSY,
+  errno.ENOTSOCK,
+  errno.EOPNOTSUPP,
+}
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+  return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+  return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+if sys.platform == 'linux':
+  _kernel_copy_functions = [
+    function for name, function in (
+      ('copy_file_range', _copy_file_range),
+      ('sendfile', _sendfile),
+    ) if hasattr(os, name)
+  ]
+else:
+  _kernel_copy_functions = []
+
+
+def _kernel_copy(
+  src_fd: int,
+  dst_fd: int,
+  offset: int,
+  size: int,
+  progress_callback: callable,
+) -> int:
+  """Copies data between file descriptors without passing it through
+  Python, starting at `offset`.
+
+  Returns the offset at which copying stopped. If the kernel refuses to
+  copy the given files, the returned offset will be less than `size`.
+  """
+  for function in _kernel_copy_functions:
+    # `os.sendfile` writes at the current position of `dst_fd`
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    while offset < size:
+      count = min(_KERNEL_COPY_BUFSIZE, size - offset)
+      try:
+        copied = function(src_fd, dst_fd, offset, count)
+      except OSError as error:
+        if error.errno not in _KERNEL_COPY_ERRNOS:
+          raise
+        break
+      if not copied:
+        break
+      offset += copied
+      progress_callback(offset, size)
+    if offset >= size:
+      break
+  return offset
+
+
+# The `FICLONE` ioctl, which makes the destination share the source's
+# data on copy-on-write filesystems, like btrfs and XFS
+_FICLONE = 0x40049409
+_LINK_ERRNOS = {
+  errno.EXDEV,
+  errno.EPERM,
+  errno.EACCES,
+  errno.EMLINK,
+  errno.EEXIST,
+  errno.ENOTSUP,
+  errno.EOPNOTSUPP,
+}
+
+_COPY_STRATEGIES = ('reflink', 'hardlink', 'copy')
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+  """Makes the destination file share the source file's data.
+
+  Returns whether it succeeded, which is only possible on Linux on
+  filesystems that support it.
+  """
+  if sys.platform != 'linux':
+    return False
+  import fcntl
+  try:
+    fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+  except OSError as error:
+    if error.errno not in _KERNEL_COPY_ERRNOS | {errno.ENOTTY}:
+      raise
+    return False
+  return True
+
+
+def _hardlink(src, dst) -> bool:
+  """Hard links the destination to the source file.
+
+  Returns whether it succeeded, which is not possible across
+  filesystems, or if the destination is another existing file.
+  """
+  try:
+    os.link(src, dst)
+  except OSError as error:
+    if error.errno not in _LINK_ERRNOS:
+      raise
+    # Copying a file onto itself would truncate it
+    return error.errno == errno.EEXIST and os.path.samefile(src, dst)
+  return True
+
+
+def _buffered_copy(
+  src_fp,
+  dst_fp,
+  offset: int,
+  size: int,
+  progress_callback: callable,
+  hasher=None,
+  end: int = None,
+) -> int:
+  """Copies data between file objects through Python buffers, starting
+  at `offset` and stopping at `end` if it's given, or at the end of
+  `src_fp` otherwise.
+
+  If a `hasher` is given, then it's updated with the copied data.
+
+  Returns the offset at which copying stopped.
+  """
   buffer_size = shutil.COPY_BUFSIZE
-  filesize = os.stat(src).st_size
-  n_buffers = math.ceil(filesize / buffer_size)
-  approximated_filesize = buffer_size * n_buffers
-  with open(src, 'rb') as src_fp, open(dst, 'wb') as dst_fp:
-    for i in range(n_buffers):
-      progress_callback(i * buffer_size, approximated_filesize)
-      dst_fp.write(src_fp.read(buffer_size))
-    progress_callback(approximated_filesize, approximated_filesize)
-
-
-def copy_tree_with_progress(src, dst, progress_callback: callable):
-  """Copies the given directory while providing current progress."""
-  queue, total_size = _statdir(src)
+  src_fp.seek(offset)
+  dst_fp.seek(offset)
+  while True:
+    if end is not None:
+      buffer_size = min(shutil.COPY_BUFSIZE, end - offset)
+      if buffer_size <= 0:
+        break
+    buffer = src_fp.read(buffer_size)
+    if not buffer:
+      break
+    dst_fp.write(buffer)
+    if hasher is not None:
+      hasher.update(buffer)
+    offset += len(buffer)
+    progress_callback(offset, max(offset, size))
+  return offset
+
+
+def _is_sparse(stat: os.stat_result) -> bool:
+  """Checks if the file has holes, which can be skipped when copying."""
+  if not hasattr(os, 'SEEK_DATA') or not hasattr(stat, 'st_blocks'):
+    return False
+  return stat.st_blocks * 512 < stat.st_size
+
+
+def _get_data_extents(fd: int, offset: int, size: int):
+  """Yields `(start, end)` ranges of a sparse file that contain data,
+  from `offset` to `size`, skipping the holes in between.
+  """
+  while offset < size:
+    try:
+      start = os.lseek(fd, offset, os.SEEK_DATA)
+    except OSError as error:
+      if error.errno == errno.ENXIO:
+        # The rest of the file is a hole
+        return
+      if error.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+        raise
+      # The filesystem can't find holes, so it's all data
+      yield offset, size
+      return
+    if start >= size:
+      return
+    end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+    yield start, end
+    offset = end
+
+
+def _sparse_copy(
+  src_fp,
+  dst_fp,
+  offset: int,
+  size: int,
+  progress_callback: callable,
+  hasher=None,
+) -> int:
+  """Copies only the data of a sparse file, starting at `offset`, and
+  recreates its holes by leaving them unwritten.
+
+  Progress is reported against the logical size of the file, skipping
+  ahead over holes. If a `hasher` is given, then it's updated with the
+  copied data, and with zeros for the holes.
+
+  Returns the logical size of the destination file.
+  """
+  src_fd = src_fp.fileno()
+  dst_fd = dst_fp.fileno()
+
+  def extent_callback(done, todo):
+    progress_callback(done, max(done, size))
+
+  for start, end in _get_data_extents(src_fd, offset, size):
+    if hasher is not None:
+      hasher.update_zeros(start - offset)
+    progress_callback(start, size)
+    copied = start
+    if hasher is None:
+      copied = _kernel_copy(src_fd, dst_fd, start, end, extent_callback)
+    offset = _buffered_copy(
+      src_fp, dst_fp, copied, size, progress_callback, hasher, end,
+    )
+  if hasher is not None:
+    hasher.update_zeros(size - offset)
+  # Extending the file over the trailing hole
+  dst_fp.truncate(size)
+  return size
+
+
+def _new_hash(checksum: str):
+  """Returns a new hash object for the given algorithm, which is either
+  one of `hashlib`'s algorithms or one of `xxhash`'s, like `'xxh3_64'`.
+  """
+  if checksum.startswith('xxh'):
+    import xxhash
+    algorithm = getattr(xxhash, checksum, None)
+    if algorithm is None:
+      raise ValueError(f"Unsupported hash algorithm '{checksum}'")
+    return algorithm()
+  import hashlib
+  return hashlib.new(checksum)
+
+
+class _HashingThread:
+  """Updates a hash object in a separate thread, so that hashing the
+  data overlaps with reading and writing it.
+
+  Both `hashlib` and `xxhash` release the GIL while hashing large
+  buffers, so the thread runs in parallel with the copying one.
+  """
+
+  def __init__(self, checksum: str):
+    import queue
+    import threading
+    self._hash = _new_hash(checksum)
+    # Bounding the amount of data waiting to be hashed
+    self._queue = queue.Queue(maxsize=16)
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    while (data := self._queue.get()) is not None:
+      self._hash.update(data)
+
+  def update(self, data: bytes):
+    """Queues the given data to be hashed."""
+    self._queue.put(data)
+
+  def update_zeros(self, size: int):
+    """Queues `size` zero bytes to be hashed."""
+    zeros = bytes(min(size, shutil.COPY_BUFSIZE))
+    while size > 0:
+      self.update(zeros[:size])
+      size -= len(zeros)
+
+  def update_from(self, fp, offset: int, size: int):
+    """Queues `size` bytes of the given file object starting at
+    `offset` to be hashed.
+    """
+    fp.seek(offset)
+    while size > 0 and (buffer := fp.read(min(size, shutil.COPY_BUFSIZE))):
+      self.update(buffer)
+      size -= len(buffer)
+
+  def hexdigest(self) -> str:
+    """Waits for the queued data to be hashed and returns the digest."""
+    self.close()
+    return self._hash.hexdigest()
+
+  def close(self):
+    """Stops the thread once the queued data has been hashed."""
+    if self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+
+
+# Copied data is synced and recorded in the journal every this many bytes
+_JOURNAL_INTERVAL = 64 * 1024 * 1024
+
+
+def _get_journal_path(dst) -> str:
+  """Returns the path of the journal of a resumable copy to `dst`."""
+  directory, name = os.path.split(os.path.abspath(dst))
+  return os.path.join(directory, f'.{name}.journal')
+
+
+class _CopyJournal:
+  """An append-only journal of how much of each file was copied, kept
+  so that an interrupted copy can be resumed.
+
+  Every line is a JSON list of `[name, size, mtime, offset]`, where
+  `size` and `mtime` identify the version of the source file, later
+  lines override earlier ones. Offsets are only recorded once the data
+  up to them has been synced to the disk.
+  """
+
+  def __init__(self, path):
+    import json
+    import threading
+    self.path = path
+    self._json = json
+    self._lock = threading.Lock()
+    self._entries = {}
+    with contextlib.ExitStack() as stack:
+      self._fp = stack.enter_context(open(path, 'a'))
+      with open(path) as fp:
+        for line in fp:
+          try:
+            name, size, mtime, offset = json.loads(line)
+          except ValueError:
+            # A line that was cut off by the interruption
+            continue
+          self._entries[name] = (size, mtime, offset)
+      # Only closing the journal if reading it failed
+      stack.pop_all()
+
+  def get_offset(self, name: str, stat: os.stat_result) -> int:
+    """Returns the offset at which copying of the given file can be
+    resumed, if the source file did not change since.
+    """
+    entry = self._entries.get(name)
+    if entry is None or entry[:2] != (stat.st_size, stat.st_mtime_ns):
+      return 0
+    return entry[2]
+
+  def is_done(self, name: str, src, dst) -> bool:
+    """Checks if the given file was already copied completely."""
+    entry = self._entries.get(name)
+    if entry is None:
+      return False
+    try:
+      stat = os.stat(src)
+      dst_size = os.stat(dst).st_size
+    except FileNotFoundError:
+      return False
+    offset = self.get_offset(name, stat)
+    return offset == stat.st_size == dst_size
+
+  def record(self, name: str, stat: os.stat_result, offset: int):
+    """Records that the given file was copied up to `offset`."""
+    line = self._json.dumps([name, stat.st_size, stat.st_mtime_ns, offset])
+    with self._lock:
+      self._fp.write(line + '\n')
+      self._fp.flush()
+
+  def close(self, remove: bool = False):
+    """Closes the journal, removing it if `remove` is true."""
+    self._fp.close()
+    if remove:
+      os.unlink(self.path)
+
+
+def _copy_file(
+  src,
+  dst,
+  progress_callback: callable,
+  strategy: str,
+  journal: _CopyJournal = None,
+  name: str = None,
+  checksum: str = None,
+) -> str | None:
+  """Copies the given file, see `copy_with_progress`.
+
+  If a `journal` is given, then copying continues from the offset
+  recorded for `name`, and the progress is recorded as it's made.
+
+  Returns the digest of the file if a `checksum` algorithm is given.
+  """
+  hasher = None
+  if checksum is not None:
+    hasher = _HashingThread(checksum)
+  try:
+    _copy_file_data(
+      src, dst, progress_callback, strategy, journal, name, hasher,
+    )
+  finally:
+    if hasher is not None:
+      hasher.close()
+  if hasher is None:
+    return None
+  return hasher.hexdigest()
+
+
+def _open_copy_destination(dst, offset: int):
+  """Opens the destination of a copy, keeping its contents if copying
+  continues from a non-zero `offset`, unless it no longer exists.
+  """
+  if not offset:
+    return open(dst, 'wb')
+  try:
+    return open(dst, 'r+b')
+  except FileNotFoundError:
+    return open(dst, 'wb')
+
+
+def _copy_file_data(
+  src,
+  dst,
+  progress_callback: callable,
+  strategy: str,
+  journal: _CopyJournal,
+  name: str,
+  hasher: _HashingThread,
+):
+  """Copies the given file's data, see `_copy_file`."""
+  if strategy == 'hardlink' and _hardlink(src, dst):
+    with open(src, 'rb') as src_fp:
+      stat = os.fstat(src_fp.fileno())
+      progress_callback(0, stat.st_size)
+      if hasher is not None:
+        hasher.update_from(src_fp, 0, stat.st_size)
+    if journal is not None:
+      journal.record(name, stat, stat.st_size)
+    progress_callback(stat.st_size, stat.st_size)
+    return
+  with open(src, 'rb') as src_fp:
+    src_fd = src_fp.fileno()
+    stat = os.fstat(src_fd)
+    filesize = stat.st_size
+    offset = 0
+    if journal is not None:
+      offset = journal.get_offset(name, stat)
+    with _open_copy_destination(dst, offset) as dst_fp:
+      dst_fd = dst_fp.fileno()
+      offset = min(offset, os.fstat(dst_fd).st_size)
+      checkpoint = offset
+
+      def journaled_callback(done, todo):
+        nonlocal checkpoint
+        if done - checkpoint >= _JOURNAL_INTERVAL:
+          dst_fp.flush()
+          os.fsync(dst_fd)
+          journal.record(name, stat, done)
+          checkpoint = done
+        progress_callback(done, todo)
+
+      callback = progress_callback
+      if journal is not None:
+        callback = journaled_callback
+      progress_callback(offset, filesize)
+      if not offset and strategy == 'reflink' and _reflink(src_fd, dst_fd):
+        copied = filesize
+        if hasher is not None:
+          hasher.update_from(src_fp, 0, filesize)
+      else:
+        copied = offset
+        if hasher is not None:
+          hasher.update_from(src_fp, 0, offset)
+        if _is_sparse(stat):
+          copied = _sparse_copy(
+            src_fp, dst_fp, offset, filesize, callback, hasher,
+          )
+        else:
+          # The data has to pass through Python to be hashed
+          if hasher is None:
+            copied = _kernel_copy(
+              src_fd, dst_fd, offset, filesize, callback,
+            )
+          copied = _buffered_copy(
+            src_fp, dst_fp, copied, filesize, callback, hasher,
+          )
+        if offset:
+          # The copy that was resumed could have been longer
+          dst_fp.truncate(copied)
+      if journal is not None:
+        dst_fp.flush()
+        os.fsync(dst_fd)
+        journal.record(name, stat, copied)
+  progress_callback(copied, copied)
+
+
+def copy_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  strategy: str = 'reflink',
+  resume: bool = False,
+  checksum: str = None,
+) -> str | None:
+  """Copies the given file while providing current progress.
+
+  The `strategy` decides how the file is copied:
+  - `'reflink'` makes the copy share the source's data on copy-on-write
+  filesystems, like btrfs and XFS, so only metadata is written.
+  - `'hardlink'` hard links the copy to the source, so both names refer
+  to the same file. Use it only if neither of them will be modified.
+  - `'copy'` always copies the data.
+
+  If a strategy can't be used for the given files, for example across
+  filesystems, the data is copied instead. On Linux the data is copied
+  by the kernel, using `os.copy_file_range` or `os.sendfile`. If the
+  kernel is unable to copy the given files, the data is copied through
+  Python buffers instead. Only the data of sparse files is copied, their
+  holes are recreated at the destination, while progress is still
+  reported against the full size.
+
+  If `resume` is true, then a journal is kept next to `dst`, recording
+  how much of the data was copied and synced to the disk. If copying is
+  interrupted, then calling this function again with `resume` continues
+  from where it stopped, unless the source file changed since. The
+  journal is removed once the copy is complete.
+
+  If a `checksum` algorithm is given, then the data is hashed while it's
+  being copied, in a separate thread, and the hex digest is returned.
+  The algorithm can be any of `hashlib`'s, like `'sha256'` or
+  `'blake2b'`, or, if `xxhash` is installed, any of its, like
+  `'xxh3_64'`. Since the data has to pass through Python to be hashed,
+  it's not copied by the kernel in that case.
+  """
+  if strategy not in _COPY_STRATEGIES:
+    raise ValueError(f"Unknown copy strategy '{strategy}'")
+  if not resume:
+    return _copy_file(
+      src, dst, progress_callback, strategy, checksum=checksum,
+    )
+  journal = _CopyJournal(_get_journal_path(dst))
+  try:
+    digest = _copy_file(
+      src, dst, progress_callback, strategy, journal, '', checksum,
+    )
+  except BaseException:
+    journal.close()
+    raise
+  journal.close(remove=True)
+  return digest
+
+
+def _run_concurrently(
+  calls,
+  workers: int,
+  progress_callback: callable,
+  on_result: callable = None,
+):
+  """Runs an iterable of `(function, *args)` calls using a pool of
+  threads.
+
+  Each function is called with an additional `report` argument, which
+  it can call with the amount of progress made since its previous call.
+  Progress is collected from the workers and `progress_callback` is
+  called from the calling thread only, with the amount of progress made
+  since the previous call.
+
+  If `on_result` is given, then it's called from the calling thread
+  with the result of every call, and can return an iterable of more
+  calls to run, which are run before the remaining ones.
+  """
+  import collections
+  import queue
+  from concurrent.futures import ThreadPoolExecutor
+
+  updates = queue.SimpleQueue()
+  max_pending = workers * 4
+  pending = 0
+  calls = iter(calls)
+  more_calls = collections.deque()
+
+  def handle_update():
+    nonlocal pending
+    update = updates.get()
+    if isinstance(update, int):
+      progress_callback(update)
+      return
+    result = update.result()
+    pending -= 1
+    if on_result is not None:
+      more_calls.extendleft(reversed(list(on_result(result) or ())))
+
+  executor = ThreadPoolExecutor(workers)
+  try:
+    while True:
+      call = more_calls.popleft() if more_calls else next(calls, None)
+      if call is None:
+        if not pending:
+          break
+        # Waiting for running calls, which may add more calls
+        handle_update()
+        continue
+      function, *args = call
+      future = executor.submit(function, *args, updates.put)
+      future.add_done_callback(updates.put)
+      pending += 1
+      while pending >= max_pending or not updates.empty():
+        handle_update()
+  finally:
+    executor.shutdown(cancel_futures=True)
+
+
+def _copy_file_reporting(
+  src,
+  dst,
+  strategy: str,
+  journal: _CopyJournal,
+  name: str,
+  checksum: str,
+  manifest: dict,
+  report: callable,
+):
+  """Copies the given file, reporting the number of bytes copied since
+  the previous report. If a `checksum` algorithm is given, then the
+  digest is stored in `manifest` under `name`.
+  """
+  copied = 0
+
+  def subprogress_callback(done, todo):
+    nonlocal copied
+    if done != copied:
+      report(done - copied)
+      copied = done
+
+  digest = _copy_file(
+    src, dst, subprogress_callback, strategy, journal, name, checksum,
+  )
+  if checksum is not None:
+    manifest[name] = digest
+
+
+def copy_tree_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  workers: int = 1,
+  strategy: str = 'reflink',
+  resume: bool = False,
+  checksum: str = None,
+) -> dict[str, str] | None:
+  """Copies the given directory while providing current progress.
+
+  Copying starts straight away, while the size of the directory is
+  still being counted in the background, so the total passed to
+  `progress_callback` is 0 until counting is finished.
+
+  If `workers` is greater than 1, then files are copied concurrently by
+  a pool of that many threads. Directories are always created before
+  their contents and `progress_callback` is only ever called from the
+  calling thread.
+
+  Each file is copied using the given `strategy`, falling back to
+  copying its data if that isn't possible, see `copy_with_progress`.
+
+  If `resume` is true, then a journal is kept next to `dst`, recording
+  which files were copied and how much of the others. If copying is
+  interrupted, then calling this function again with `resume` skips
+  the files that were already copied and continues the rest from where
+  they stopped. The journal is removed once the copy is complete.
+
+  If a `checksum` algorithm is given, then files are hashed while they
+  are being copied, see `copy_with_progress`, and a manifest is
+  returned, mapping paths of files relative to `dst` to their digests.
+  """
+  if strategy not in _COPY_STRATEGIES:
+    raise ValueError(f"Unknown copy strategy '{strategy}'")
+  journal = None
+  if resume:
+    journal = _CopyJournal(_get_journal_path(dst))
+  manifest = {}
   bytes_copied = 0
 
+  def add_progress(n_bytes: int):
+    nonlocal bytes_copied
+    bytes_copied += n_bytes
+    progress_callback(bytes_copied, counter.total())
+
   def subprogress_callback(done, todo):
-    progress_callback(done + bytes_copied, total_size)
-
-  os.mkdir(dst)
-  for entry, is_dir, size in queue:
-    progress_callback(bytes_copied, total_size)
-    entry_dst = os.path.join(dst, os.path.relpath(entry, src))
-    if is_dir:
-      os.mkdir(entry_dst)
-    else:
-      copy_with_progress(entry, entry_dst, subprogress_callback)
-    bytes_copied += size
-  progress_callback(bytes_copied, total_size)
+    progress_callback(bytes_copied + done, counter.total())
+
+  def scan():
+    for entry in _scantree(src):
+      name = os.path.relpath(entry.path, src)
+      entry_dst = os.path.join(dst, name)
+      if entry.is_dir:
+        os.makedirs(entry_dst, exist_ok=resume)
+        add_progress(entry.size)
+      elif (
+        resume and checksum is None
+        and journal.is_done(name, entry.path, entry_dst)
+      ):
+        add_progress(entry.size)
+      else:
+        yield entry, entry_dst, name
+
+  try:
+    os.makedirs(dst, exist_ok=resume)
+    with _TreeCounter(src) as counter:
+      progress_callback(0, counter.total())
+      if workers > 1:
+        calls = (
+          (
+            _copy_file_reporting, entry.path, entry_dst, strategy,
+            journal, name, checksum, manifest,
+          )
+          for entry, entry_dst, name in scan()
+        )
+        _run_concurrently(calls, workers, add_progress)
+      else:
+        for entry, entry_dst, name in scan():
+          digest = _copy_file(
+            entry.path, entry_dst, subprogress_callback, strategy,
+            journal, name, checksum,
+          )
+          if checksum is not None:
+            manifest[name] = digest
+          add_progress(entry.size)
+    progress_callback(bytes_copied, bytes_copied)
+  except BaseException:
+    if journal is not None:
+      journal.close()
+    raise
+  if journal is not None:
+    journal.close(remove=True)
+  if checksum is None:
+    return None
+  return manifest
+
+
+# Deleting relative to directory file descriptors, where it's supported
+_unlink_with_dir_fd = hasattr(os, 'fwalk') and {
+  os.open, os.stat, os.unlink, os.rmdir,
+} <= os.supports_dir_fd
 
 
-def unlink_tree_with_progress(directory, progress_callback: callable):
-  """Deletes the given directory while providing current progress."""
+def _unlink_at(name: str, dir_fd: int, report: callable):
+  """Deletes a file relative to `dir_fd`, reporting its size."""
+  size = os.stat(name, dir_fd=dir_fd, follow_symlinks=False).st_size
+  os.unlink(name, dir_fd=dir_fd)
+  report(size)
+
+
+def _unlink_tree_at(name: str, dir_fd: int, report: callable):
+  """Deletes a directory tree relative to `dir_fd`, reporting the sizes
+  of deleted files and directories.
+
+  Directories are reported by their size from before their contents were
+  deleted, since on some file systems, like tmpfs, they shrink.
+  """
+  sizes = {}
+  walk = os.fwalk(name, topdown=False, dir_fd=dir_fd)
+  for root, dirnames, filenames, root_fd in walk:
+    sizes[root] = os.fstat(root_fd).st_size
+    for filename in filenames:
+      _unlink_at(filename, root_fd, report)
+    for dirname in dirnames:
+      size = sizes.pop(os.path.join(root, dirname), None)
+      if size is None:
+        # A symbolic link to a directory, which wasn't walked
+        _unlink_at(dirname, root_fd, report)
+        continue
+      os.rmdir(dirname, dir_fd=root_fd)
+      report(size)
+  os.rmdir(name, dir_fd=dir_fd)
+  report(sizes.pop(name))
+
+
+def _unlink_files_at(fd: int, report: callable) -> list[str]:
+  """Deletes everything but subdirectories directly inside of the
+  directory `fd`, reporting the sizes of deleted files.
+
+  Returns the names of the subdirectories.
+  """
+  subdirectories = []
+  with os.scandir(fd) as entries:
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        subdirectories.append(entry.name)
+      else:
+        _unlink_at(entry.name, fd, report)
+  return subdirectories
+
+
+class _UnlinkNode:
+  """A directory being deleted by `_unlink_tree_concurrently`."""
+  __slots__ = ('fd', 'name', 'parent', 'remaining', 'size')
+
+  def __init__(self, parent, name: str):
+    self.parent = parent
+    self.name = name
+    self.fd = None
+    self.size = 0
+    self.remaining = 0
+
+
+def _unlink_node_files(node: _UnlinkNode, report: callable) -> tuple:
+  """Opens the given directory relative to its parent's file descriptor
+  and deletes its files, see `_unlink_files_at`.
+
+  Returns the node, whose `fd` is left open for deleting its
+  subdirectories, and the names of those subdirectories.
+  """
+  flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+  flags |= getattr(os, 'O_NOFOLLOW', 0)
+  fd = os.open(node.name, flags, dir_fd=node.parent.fd)
+  try:
+    node.size = os.fstat(fd).st_size
+    subdirectories = _unlink_files_at(fd, report)
+  except BaseException:
+    os.close(fd)
+    raise
+  node.fd = fd
+  return node, subdirectories
+
+
+def _unlink_tree_concurrently(dir_fd: int, workers: int, report: callable):
+  """Deletes the contents of the directory `dir_fd` using a pool of
+  threads, where the files of every directory, at any depth, are
+  deleted by a separate call.
+
+  Every directory is opened relative to its parent's file descriptor,
+  and is deleted relative to it by the calling thread once it's empty.
+  """
+  root = _UnlinkNode(None, '.')
+  root.fd = dir_fd
+  nodes = set()
+
+  def remove(node: _UnlinkNode):
+    # Deleting the emptied directory and any emptied parents of it
+    while node is not root and not node.remaining:
+      os.close(node.fd)
+      node.fd = None
+      nodes.discard(node)
+      os.rmdir(node.name, dir_fd=node.parent.fd)
+      report(node.size)
+      node = node.parent
+      node.remaining -= 1
+
+  def add_subdirectories(node: _UnlinkNode, names: list[str]) -> list:
+    children = [_UnlinkNode(node, name) for name in names]
+    node.remaining = len(children)
+    nodes.update(children)
+    remove(node)
+    return [(_unlink_node_files, child) for child in children]
+
+  def on_result(result: tuple) -> list:
+    return add_subdirectories(*result)
+
+  try:
+    calls = add_subdirectories(root, _unlink_files_at(dir_fd, report))
+    _run_concurrently(calls, workers, report, on_result)
+  finally:
+    for node in nodes:
+      if node.fd is not None:
+        os.close(node.fd)
+
+
+def unlink_tree_with_progress(
+  directory,
+  progress_callback: callable,
+  workers: int = 1,
+):
+  """Deletes the given directory while providing current progress.
+
+  Deleting starts straight away, while the size of the directory is
+  still being counted in the background, so the total passed to
+  `progress_callback` is 0 until counting is finished.
+
+  Where it's supported, entries are deleted relative to the file
+  descriptors of their directories, instead of by their full paths.
+  If `workers` is greater than 1, then the files of every directory in
+  the tree are deleted concurrently by a pool of that many threads.
+  Either way `progress_callback` is only ever called from the calling
+  thread.
+
+  Symbolic links are deleted, not followed.
+  """
   bytes_deleted = 0
-  queue, total_size = _statdir(directory)
-  queue.reverse()
-  for entry, is_dir, size in queue:
-    progress_callback(bytes_deleted, total_size)
-    if is_dir:
-      os.rmdir(entry)
+
+  def add_progress(n_bytes: int):
+    nonlocal bytes_deleted
+    bytes_deleted += n_bytes
+    progress_callback(bytes_deleted, counter.total())
+
+  with _TreeCounter(directory, follow_symlinks=False) as counter:
+    progress_callback(0, counter.total())
+    if _unlink_with_dir_fd:
+      dir_fd = os.open(directory, os.O_RDONLY)
+      try:
+        if workers > 1:
+          _unlink_tree_concurrently(dir_fd, workers, add_progress)
+        else:
+          subdirectories = _unlink_files_at(dir_fd, add_progress)
+          for name in subdirectories:
+            _unlink_tree_at(name, dir_fd, add_progress)
+      finally:
+        os.close(dir_fd)
     else:
-      os.unlink(entry)
-    bytes_deleted += size
-  os.rmdir(directory)
-  progress_callback(bytes_deleted, total_size)
+      entries = _scantree(directory, topdown=False, follow_symlinks=False)
+      for entry in entries:
+        if entry.is_dir:
+          os.rmdir(entry.path)
+        else:
+          os.unlink(entry.path)
+        add_progress(entry.size)
+    os.rmdir(directory)
+  progress_callback(bytes_deleted, bytes_deleted)
+
+
+def _scan_sizes(
+  directory,
+  allocated: bool,
+  device: int | None,
+) -> tuple[int, list[tuple[int, int, int]], list[str]]:
+  """Sums up the sizes of files directly inside of the given directory.
+
+  Files with more than one hard link are not added to the sum, but
+  are returned separately, so that they can be deduplicated.
+
+  Return tuple format: `(size, [(st_dev, st_ino, size)], subdirectories)`
+  """
+  size = 0
+  links = []
+  subdirectories = []
+  with os.scandir(directory) as entries:
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        if (
+          device is None
+          or entry.stat(follow_symlinks=False).st_dev == device
+        ):
+          subdirectories.append(entry.path)
+        continue
+      stat = entry.stat(follow_symlinks=False)
+      if allocated:
+        if hasattr(stat, 'st_blocks'):
+          n_bytes = stat.st_blocks * 512
+        else:
+          n_bytes = stat.st_size
+      else:
+        n_bytes = stat.st_size
+      if stat.st_nlink > 1:
+        links.append((stat.st_dev, stat.st_ino, n_bytes))
+      else:
+        size += n_bytes
+  return size, links, subdirectories
+
+
+class SizeIndex:
+  """A persistent index of directory sizes, used by `get_tree_size` to
+  only rescan directories whose modification time has changed.
+
+  The index is stored in `platformdirs.user_cache_dir`, similarly to
+  how `Secretary` stores configuration files.
+
+  Note that the modification time of a directory only changes when
+  entries are added to, removed from or renamed inside of it. Files
+  that change in size without being replaced are not noticed until
+  their directory is modified.
+  """
+
+  def __init__(
+    self,
+    program: str,
+    author: str = None,
+    version: str = None,
+  ):
+    import platformdirs
+    self.directory = platformdirs.user_cache_dir(program, author, version)
+
+  def _get_file(self, *key) -> str:
+    import hashlib
+    name = hashlib.sha256(repr(key).encode()).hexdigest()
+    return os.path.join(self.directory, 'sizes-' + name + '.json')
 
+  def _load(self, *key) -> dict[str, list]:
+    import json
+    try:
+      with open(self._get_file(*key), 'rb') as fp:
+        return json.load(fp)
+    except (OSError, ValueError):
+      return {}
 
-def get_tree_size(directory) -> int:
-  """Returns the size of the given directory in bytes."""
+  def _save(self, records: dict[str, list], *key):
+    import json
+    import tempfile
+    file = self._get_file(*key)
+    os.makedirs(self.directory, exist_ok=True)
+    # A unique temporary file, since other processes may save concurrently
+    fd, tmp_file = tempfile.mkstemp('.tmp', '.sizes-', self.directory)
+    try:
+      with open(fd, 'w') as fp:
+        json.dump(records, fp)
+      os.replace(tmp_file, file)
+    except BaseException:
+      os.unlink(tmp_file)
+      raise
+
+  def clear(self):
+    """Deletes all of the stored directory sizes."""
+    if not os.path.isdir(self.directory):
+      return
+    for entry in os.scandir(self.directory):
+      if entry.name.startswith('sizes-'):
+        os.unlink(entry.path)
+
+
+def get_tree_size(
+  directory,
+  allocated: bool = False,
+  one_file_system: bool = False,
+  workers: int = 1,
+  index: SizeIndex = None,
+) -> int:
+  """Returns the size of the given directory in bytes.
+
+  Hard linked files are counted only once, symbolic links are not
+  followed, and the sizes of directories themselves are not counted,
+  only those of their contents.
+
+  By default the apparent size of files is used. If `allocated` is
+  true, then the space allocated for files on disk is used instead.
+
+  If `one_file_system` is true, then directories on other filesystems
+  are skipped.
+
+  If `workers` is greater than 1, then directories are scanned
+  concurrently by a pool of that many threads, which is much faster on
+  high-latency filesystems.
+
+  If an `index` is given, then only the directories that were modified
+  since the previous call with the same index are rescanned.
+  """
+  device = os.stat(directory).st_dev if one_file_system else None
   total_size = 0
-  for entry in os.scandir(directory):
-    total_size += entry.stat().st_size
-    if entry.is_dir():
-      total_size += get_tree_size(entry)
+  seen_links = set()
+  scan = _scan_sizes
+
+  if index is not None:
+    directory = os.path.abspath(directory)
+    key = (directory, allocated, one_file_system)
+    records = index._load(*key)
+    new_records = {}
+
+    def scan(directory, allocated: bool, device: int | None):
+      mtime = os.stat(directory).st_mtime_ns
+      record = records.get(directory)
+      if record is None or record[0] != mtime:
+        record = [mtime, *_scan_sizes(directory, allocated, device)]
+      new_records[directory] = record
+      return record[1:]
+
+  def add(result) -> list[str]:
+    nonlocal total_size
+    size, links, subdirectories = result
+    total_size += size
+    for dev, ino, link_size in links:
+      if (dev, ino) not in seen_links:
+        seen_links.add((dev, ino))
+        total_size += link_size
+    return subdirectories
+
+  if workers > 1:
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    executor = ThreadPoolExecutor(workers)
+    try:
+      pending = {executor.submit(scan, directory, allocated, device)}
+      while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+          for subdirectory in add(future.result()):
+            pending.add(executor.submit(
+              scan, subdirectory, allocated, device,
+            ))
+    finally:
+      executor.shutdown(cancel_futures=True)
+  else:
+    directories = [directory]
+    while directories:
+      result = scan(directories.pop(), allocated, device)
+      directories += add(result)
+  if index is not None:
+    index._save(new_records, *key)
   return total_size
 
 
@@ -121,6 +1312,7 @@ def to_readable_size(
 
 def start(*args) -> int:
   """Like xdg-open, but platform-aware."""
+  import subprocess
   commands = {
     'linux': 'xdg-open',
     'darwin': 'open',
@@ -184,75 +1376,598 @@ def _generic_unpack(src, dst, cls):
     obj.extractall(dst)
 
 
+class _ReportingReader:
+  """Wraps a file object, reporting the number of bytes read from it."""
+
+  def __init__(self, fp, report: callable):
+    self._fp = fp
+    self._report = report
+
+  def read(self, size: int = -1) -> bytes:
+    data = self._fp.read(size)
+    if data:
+      self._report(len(data))
+    return data
+
+  def __getattr__(self, name: str):
+    return getattr(self._fp, name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self._fp.close()
+
+
+def _report_reads(archive, report: callable):
+  """Makes the given archive report the number of bytes read from its
+  members, which is the number of bytes that were extracted.
+
+  Both `ZipFile.extract` and `RarFile.extract` copy members by reading
+  them through the archive's `open` method, so this keeps all of their
+  extraction logic intact.
+  """
+  open_member = type(archive).open.__get__(archive)
+
+  def open_reporting(*args, **kwargs):
+    return _ReportingReader(open_member(*args, **kwargs), report)
+
+  archive.open = open_reporting
+
+
 def _generic_unpack_with_progress(
   src,
   dst,
   progress_callback: callable,
   cls,
-  namelist_function_name: str,
 ):
   with cls(src) as obj:
-    namelist = getattr(obj, namelist_function_name)
-    names = namelist()
-    n_names = len(names)
-    unpacked = 0
-    for name in names:
-      progress_callback(unpacked, n_names)
-      obj.extract(name, dst)
-      unpacked += 1
-    progress_callback(unpacked, n_names)
-
-
-def pack_zip(src, dst):
-  """Packs the given directory to a zip file."""
-  from zipfile import ZipFile
-  _generic_pack(src, dst, ZipFile, 'write')
+    infos = obj.infolist()
+    todo = sum(info.file_size for info in infos)
+    done = 0
+
+    def report(n_bytes: int):
+      nonlocal done
+      done += n_bytes
+      progress_callback(done, todo)
+
+    _report_reads(obj, report)
+    progress_callback(done, todo)
+    for info in infos:
+      obj.extract(info, dst)
+    progress_callback(todo, todo)
+
+
+# Compressed members bigger than this are spooled to disk while they
+# wait to be written to the archive
+_ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def _deflate_file(path, compresslevel: int):
+  """Compresses the given file into a raw deflate stream.
+
+  Return tuple format: `(data file object, CRC, size, compressed size)`
+  """
+  import tempfile
+  import zlib
+  compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+  crc = 0
+  size = 0
+  with contextlib.ExitStack() as stack:
+    data = stack.enter_context(tempfile.SpooledTemporaryFile(_ZIP_SPOOL_SIZE))
+    with open(path, 'rb') as fp:
+      while buffer := fp.read(shutil.COPY_BUFSIZE):
+        crc = zlib.crc32(buffer, crc)
+        size += len(buffer)
+        data.write(compressor.compress(buffer))
+    data.write(compressor.flush())
+    compressed_size = data.tell()
+    data.seek(0)
+    # Only closing the data if compressing failed
+    stack.pop_all()
+  return data, crc, size, compressed_size
+
+
+# Private `ZipFile` state used by `_write_raw_zip_member`
+_RAW_ZIP_ATTRIBUTES = ('_seekable', '_writecheck', '_didModify', 'start_dir')
+
+
+def _can_write_raw_zip_members(zip_file) -> bool:
+  """Checks if `_write_raw_zip_member` can be used with the given zip
+  file, which depends on `zipfile` internals that may change.
+  """
+  return all(hasattr(zip_file, name) for name in _RAW_ZIP_ATTRIBUTES)
+
+
+def _write_raw_zip_member(zip_file, info, data):
+  """Writes an already compressed member to the given zip file,
+  copying `compress_size` bytes from the `data` file object.
+
+  The `CRC`, `file_size` and `compress_size` of the given `ZipInfo`
+  must be set. There is no public `zipfile` API for this, so this
+  mirrors what `ZipFile.open` does when writing a member. Check
+  `_can_write_raw_zip_members` before using it.
+  """
+  # The sizes are known, so there's no need for a data descriptor
+  info.flag_bits &= ~0x08
+  if zip_file._seekable:
+    zip_file.fp.seek(zip_file.start_dir)
+  info.header_offset = zip_file.fp.tell()
+  zip_file._writecheck(info)
+  zip_file._didModify = True
+  zip_file.fp.write(info.FileHeader())
+  remaining = info.compress_size
+  while remaining:
+    buffer = data.read(min(remaining, shutil.COPY_BUFSIZE))
+    if not buffer:
+      raise EOFError(f"Data of '{info.filename}' ended unexpectedly")
+    zip_file.fp.write(buffer)
+    remaining -= len(buffer)
+  zip_file.start_dir = zip_file.fp.tell()
+  zip_file.filelist.append(info)
+  zip_file.NameToInfo[info.filename] = info
+
+
+# Local file header of zip members: its signature and size, and the
+# offset of the file name and extra field lengths within it
+_ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_LOCAL_HEADER_LENGTHS_OFFSET = 26
+_ZIP64_EXTRA_ID = 0x0001
+
+
+def _strip_zip64_extra(extra: bytes) -> bytes:
+  """Returns the given zip extra field without its zip64 records."""
+  import struct
+  kept = []
+  i = 0
+  while i + 4 <= len(extra):
+    extra_id, length = struct.unpack('<HH', extra[i:i + 4])
+    end = i + 4 + length
+    if extra_id != _ZIP64_EXTRA_ID:
+      kept.append(extra[i:end])
+    i = end
+  # Keeping trailing bytes that don't form a whole record
+  kept.append(extra[i:])
+  return b''.join(kept)
+
+
+def _seek_raw_zip_member(zip_file, info):
+  """Seeks the file of the given zip file to the compressed data of the
+  given member, and returns a copy of its `ZipInfo` that can be passed
+  to `_write_raw_zip_member` along with that file.
+  """
+  import copy
+  import struct
+  import zipfile
+  fp = zip_file.fp
+  fp.seek(info.header_offset)
+  header = fp.read(_ZIP_LOCAL_HEADER_SIZE)
+  if (
+    len(header) != _ZIP_LOCAL_HEADER_SIZE
+    or not header.startswith(_ZIP_LOCAL_HEADER_SIGNATURE)
+  ):
+    raise zipfile.BadZipFile(f"Bad local header of '{info.filename}'")
+  name_length, extra_length = struct.unpack_from(
+    '<HH', header, _ZIP_LOCAL_HEADER_LENGTHS_OFFSET,
+  )
+  fp.seek(name_length + extra_length, os.SEEK_CUR)
+  info = copy.copy(info)
+  # The zip64 field is added again when writing, if it's needed
+  info.extra = _strip_zip64_extra(info.extra)
+  return info
+
+
+def _get_pack_files(src) -> list[tuple[str, str]]:
+  """Returns `(path, name in archive)` pairs of files to pack."""
+  if not os.path.isdir(src):
+    return [(src, os.path.basename(src))]
+  files = []
+  for root, dirs, filenames in os.walk(src):
+    for name in filenames:
+      path = os.path.join(root, name)
+      files.append((path, os.path.relpath(path, src)))
+  return files
+
+
+class PackPolicy:
+  """Decides how much each file is compressed when packing archives.
+
+  Files that are already compressed, like images, videos and other
+  archives, are stored without compression, since compressing them
+  again takes time and gains nothing. Such files are recognised by
+  their extension and, if `detect_content` is true, by their contents
+  using `filetype`. Any other files are compressed with the given
+  `level`.
+
+  The `levels` dictionary maps glob patterns, matched against names of
+  files inside the archive, to compression levels. A level of None
+  means that matching files are stored without compression. Patterns
+  take precedence over everything else, the first matching pattern is
+  used.
+
+  The `compressed_extensions`, if given, replace the default set of
+  extensions of files that are already compressed.
+
+  Usage example:
+  ```
+  policy = PackPolicy(levels={'*.log': 9, 'vendor/*': None})
+  pack_zip('bundle', 'bundle.zip', policy=policy)
+  ```
+  """
+
+  compressed_extensions = frozenset({
+    # Images
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'avif', 'jxl',
+    # Audio and video
+    'mp3', 'm4a', 'aac', 'ogg', 'oga', 'opus', 'flac',
+    'mp4', 'm4v', 'mkv', 'webm', 'mov', 'avi',
+    # Archives and packages
+    'zip', '7z', 'rar', 'gz', 'tgz', 'bz2', 'xz', 'txz', 'zst', 'lz4',
+    'whl', 'jar', 'apk', 'deb', 'rpm', 'epub',
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp',
+    # Other
+    'woff', 'woff2', 'pdf',
+  })
+  """Extensions of files that are stored without compression."""
+
+  def __init__(
+    self,
+    level: int = 6,
+    levels: dict[str, int | None] = None,
+    detect_content: bool = True,
+    compressed_extensions: set[str] = None,
+  ):
+    self.level = level
+    self.levels = levels or {}
+    self.detect_content = detect_content
+    if compressed_extensions is not None:
+      self.compressed_extensions = frozenset(compressed_extensions)
+
+  def is_compressed(self, path) -> bool:
+    """Checks if the given file is already compressed."""
+    ext = os.path.splitext(path)[1].removeprefix('.').lower()
+    if ext in self.compressed_extensions:
+      return True
+    if ext or not self.detect_content:
+      return False
+    import filetype
+    return filetype.guess_extension(path) in self.compressed_extensions
+
+  def get_level(self, path, name: str) -> int | None:
+    """Returns the compression level for the given file, or None if it
+    should be stored without compression.
+    """
+    import fnmatch
+    for pattern, level in self.levels.items():
+      if fnmatch.fnmatch(name, pattern):
+        return level
+    if self.is_compressed(path):
+      return None
+    return self.level
+
+
+def _pack_zip(
+  src,
+  dst,
+  compresslevel: int,
+  workers: int,
+  policy: PackPolicy,
+  update: bool,
+  progress_callback: callable = None,
+  old_zip_file=None,
+):
+  """Packs the given directory to a zip file.
+
+  If `workers` is greater than 1, then files are compressed using a
+  pool of threads and are written to the archive in order. If this
+  version of `zipfile` doesn't allow writing compressed members, then
+  files are compressed one by one instead.
+
+  If `update` is true and `dst` exists, then the archive is written to
+  a temporary file next to it, which then replaces it. Members of the
+  old archive whose size and modification time match their source file
+  are copied over as they are, without being compressed again, if this
+  version of `zipfile` allows it. The permissions of `dst` are kept.
+  """
+  import collections
+  from concurrent.futures import ThreadPoolExecutor
+  from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+  if update and os.path.exists(dst):
+    import tempfile
+    directory, name = os.path.split(os.path.abspath(dst))
+    fd, tmp_dst = tempfile.mkstemp('.tmp', f'.{name}.', directory)
+    os.close(fd)
+    try:
+      with ZipFile(dst) as existing_zip_file:
+        _pack_zip(
+          src, tmp_dst, compresslevel, workers, policy, False,
+          progress_callback, existing_zip_file,
+        )
+      # The temporary file is only readable by its owner
+      shutil.copymode(dst, tmp_dst)
+      os.replace(tmp_dst, dst)
+    except BaseException:
+      os.unlink(tmp_dst)
+      raise
+    return
+  files = _get_pack_files(src)
+  n_files = len(files)
+  packed = 0
+  pending = collections.deque()
+
+  def get_level(path, name) -> int | None:
+    if policy is None:
+      return compresslevel
+    return policy.get_level(path, name)
+
+  def write(path, name, level: int | None):
+    if level is None:
+      zip_file.write(path, name, ZIP_STORED)
+    else:
+      zip_file.write(path, name, ZIP_DEFLATED, level)
+
+  def get_unchanged(path, name) -> ZipInfo | None:
+    if old_zip_file is None or not _can_write_raw_zip_members(zip_file):
+      # Members can only be copied over using `zipfile` internals
+      return None
+    info = ZipInfo.from_file(path, name)
+    old_info = old_zip_file.NameToInfo.get(info.filename)
+    if old_info is None or old_info.is_dir():
+      return None
+    if old_info.file_size != info.file_size:
+      return None
+    # Zip files store modification times with a resolution of 2 seconds
+    old_time, new_time = old_info.date_time, info.date_time
+    if old_time[:5] != new_time[:5] or old_time[5] // 2 != new_time[5] // 2:
+      return None
+    return old_info
+
+  def write_next():
+    nonlocal packed
+    path, name, level, future, old_info = pending.popleft()
+    if old_info is not None:
+      info = _seek_raw_zip_member(old_zip_file, old_info)
+      _write_raw_zip_member(zip_file, info, old_zip_file.fp)
+    elif future is None:
+      write(path, name, level)
+    else:
+      data, crc, size, compressed_size = future.result()
+      info = ZipInfo.from_file(path, name)
+      info.compress_type = ZIP_DEFLATED
+      info.CRC = crc
+      info.file_size = size
+      info.compress_size = compressed_size
+      with data:
+        _write_raw_zip_member(zip_file, info, data)
+    packed += 1
+    if progress_callback:
+      progress_callback(packed, n_files)
+
+  if progress_callback:
+    progress_callback(packed, n_files)
+  executor = None
+  max_ahead = 0
+  try:
+    with ZipFile(dst, 'w') as zip_file:
+      if workers > 1 and _can_write_raw_zip_members(zip_file):
+        executor = ThreadPoolExecutor(workers)
+        max_ahead = workers * 2
+      for path, name in files:
+        level = None
+        future = None
+        old_info = get_unchanged(path, name)
+        if old_info is None:
+          level = get_level(path, name)
+        if executor is not None and old_info is None and level is not None:
+          future = executor.submit(_deflate_file, path, level)
+        pending.append((path, name, level, future, old_info))
+        # Writing files in order, while the next few are compressed
+        while len(pending) > max_ahead:
+          write_next()
+      while pending:
+        write_next()
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
 
 
-def pack_zip_with_progress(src, dst, progress_callback: callable):
+def pack_zip(
+  src,
+  dst,
+  compresslevel: int = None,
+  workers: int = 1,
+  policy: PackPolicy = None,
+  update: bool = False,
+):
+  """Packs the given directory to a zip file.
+
+  If `compresslevel` is given, then files are compressed using deflate
+  with the given level, from 0 to 9. Otherwise they are stored without
+  compression. If a `policy` is given, then it decides the compression
+  level of each file instead.
+
+  If `workers` is greater than 1, then files are compressed
+  concurrently by a pool of that many threads, and then written to the
+  archive in the same order as they would otherwise be.
+
+  If `update` is true and `dst` already exists, then only the files
+  that changed since it was packed are compressed. Members whose size
+  and modification time match their source file are copied from the
+  old archive as they are, keeping their compression. Members without
+  a source file are left out. The new archive replaces the old one
+  once it's complete.
+  """
+  _pack_zip(src, dst, compresslevel, workers, policy, update)
+
+
+def pack_zip_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  compresslevel: int = None,
+  workers: int = 1,
+  policy: PackPolicy = None,
+  update: bool = False,
+):
   """Packs the given directory to a zip file while providing the
   current progress.
+
+  See `pack_zip` for the `compresslevel`, `workers`, `policy` and
+  `update` parameters.
   """
-  from zipfile import ZipFile
-  _generic_pack_with_progress(
-    src, dst,
-    progress_callback,
-    ZipFile, 'write'
+  _pack_zip(
+    src, dst, compresslevel, workers, policy, update, progress_callback,
   )
 
 
-def unpack_zip(src, dst):
-  """Unpacks the given zip archive to the specified directory."""
+def _get_zip_member_path(info, dst) -> str:
+  """Returns the path `ZipFile.extract` extracts the given member to."""
+  from zipfile import ZipFile
+  name = info.filename.replace('/', os.path.sep)
+  if os.path.altsep:
+    name = name.replace(os.path.altsep, os.path.sep)
+  name = os.path.splitdrive(name)[1]
+  invalid_parts = ('', os.path.curdir, os.path.pardir)
+  parts = [part for part in name.split(os.path.sep) if part not in invalid_parts]
+  name = os.path.sep.join(parts)
+  if os.path.sep == '\\':
+    name = ZipFile._sanitize_windows_name(name, os.path.sep)
+  return os.path.normpath(os.path.join(dst, name))
+
+
+def _unpack_zip_concurrently(
+  src,
+  dst,
+  workers: int,
+  progress_callback: callable = None,
+):
+  """Unpacks the given zip archive using a pool of threads, each with
+  its own `ZipFile` handle.
+
+  Directories are created up front, so that workers never race to
+  create them.
+  """
+  import threading
+  from zipfile import ZipFile
+  dst = os.fspath(dst)
+  with ZipFile(src) as zip_file:
+    infos = zip_file.infolist()
+  todo = sum(info.file_size for info in infos)
+  done = 0
+  # Creating directories
+  for info in infos:
+    path = _get_zip_member_path(info, dst)
+    if info.is_dir():
+      os.makedirs(path, exist_ok=True)
+    else:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+  # Extracting files
+  handles = []
+  local = threading.local()
+
+  def extract(info, report: callable):
+    zip_file = getattr(local, 'zip_file', None)
+    if zip_file is None:
+      zip_file = local.zip_file = ZipFile(src)
+      handles.append(zip_file)
+    _report_reads(zip_file, report)
+    zip_file.extract(info, dst)
+
+  def add_progress(n_bytes: int):
+    nonlocal done
+    done += n_bytes
+    if progress_callback:
+      progress_callback(done, todo)
+
+  if progress_callback:
+    progress_callback(done, todo)
+  try:
+    calls = ((extract, info) for info in infos if not info.is_dir())
+    _run_concurrently(calls, workers, add_progress)
+  finally:
+    for zip_file in handles:
+      zip_file.close()
+  if progress_callback:
+    progress_callback(todo, todo)
+
+
+def unpack_zip(src, dst, workers: int = 1):
+  """Unpacks the given zip archive to the specified directory.
+
+  If `workers` is greater than 1, then members are extracted
+  concurrently by a pool of that many threads.
+  """
   from zipfile import ZipFile
-  _generic_unpack(src, dst, ZipFile)
+  if workers > 1:
+    _unpack_zip_concurrently(src, dst, workers)
+  else:
+    _generic_unpack(src, dst, ZipFile)
 
 
-def unpack_zip_with_progress(src, dst, progress_callback: callable):
+def unpack_zip_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  workers: int = 1,
+):
   """Unpacks the given zip archive to the specified directory while
   providing current progress.
+
+  See `unpack_zip` for the `workers` parameter.
   """
   from zipfile import ZipFile
-  _generic_unpack_with_progress(
-    src,
-    dst,
-    progress_callback,
-    ZipFile,
-    'namelist',
-  )
+  if workers > 1:
+    _unpack_zip_concurrently(src, dst, workers, progress_callback)
+  else:
+    _generic_unpack_with_progress(src, dst, progress_callback, ZipFile)
 
 
-def pack_7z(src, dst):
-  """Packs the given directory to a 7zip file."""
-  from py7zr import SevenZipFile
-  _generic_pack(src, dst, SevenZipFile, 'write')
+def _get_7z_class(src, policy: PackPolicy = None):
+  """Returns the `SevenZipFile` class, set up according to the given
+  policy.
 
+  py7zr applies the same filters to every file in an archive, so files
+  are only stored without compression if the policy says so for all
+  of them. Otherwise LZMA2 is used, with the policy's default level.
+  """
+  import py7zr
+  if policy is None:
+    return py7zr.SevenZipFile
+  levels = {
+    policy.get_level(path, name) for path, name in _get_pack_files(src)
+  }
+  if levels == {None}:
+    filters = [{'id': py7zr.FILTER_COPY}]
+  else:
+    filters = [{'id': py7zr.FILTER_LZMA2, 'preset': policy.level}]
+  return functools.partial(py7zr.SevenZipFile, filters=filters)
 
-def pack_7z_with_progress(src, dst, progress_callback: callable):
-  from py7zr import SevenZipFile
+
+def pack_7z(src, dst, policy: PackPolicy = None):
+  """Packs the given directory to a 7zip file.
+
+  Since the same compression is used for all files in a 7zip archive,
+  the `policy` can only decide whether the whole archive is compressed.
+  """
+  _generic_pack(src, dst, _get_7z_class(src, policy), 'write')
+
+
+def pack_7z_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  policy: PackPolicy = None,
+):
+  """Packs the given directory to a 7zip file while providing the
+  current progress.
+
+  See `pack_7z` for the `policy` parameter.
+  """
   _generic_pack_with_progress(
     src, dst,
     progress_callback,
-    SevenZipFile, 'write'
+    _get_7z_class(src, policy), 'write'
   )
 
 
@@ -263,7 +1978,7 @@ def unpack_7z(src, dst):
 
 
 def unpack_7z_with_progress(src, dst, progress_callback: callable):
-  """Unpacks the given tar archive to the specified directory while
+  """Unpacks the given 7zip archive to the specified directory while
   providing current progress.
   """
   from py7zr import SevenZipFile, callbacks
@@ -271,30 +1986,38 @@ def unpack_7z_with_progress(src, dst, progress_callback: callable):
     def __init__(self, todo: int):
       self.todo = todo
       self.done = 0
+      self.finished = 0
 
     def report_start_preparation(self):
       progress_callback(self.done, self.todo)
 
     def report_start(self, file, size):
-      progress_callback(self.done, self.todo)
-      self.done += 1
+      pass
 
     def report_end(self, file, size):
-      progress_callback(self.done, self.todo)
+      # Accounting for files that did not report their progress
+      self.finished += int(size)
+      if self.finished > self.done:
+        self.done = self.finished
+        progress_callback(self.done, self.todo)
 
     def report_postprocess(self):
       pass
 
     def report_update(self, size):
-      pass
+      self.done += int(size)
+      progress_callback(self.done, self.todo)
 
     def report_warning(self, message):
       pass
 
   with SevenZipFile(src) as obj:
-    to_unpack = len(obj.namelist())
+    to_unpack = sum(
+      info.uncompressed for info in obj.list() if not info.is_directory
+    )
     callback = Callback(to_unpack)
     obj.extractall(dst, callback=callback)
+  progress_callback(to_unpack, to_unpack)
 
 
 def unpack_rar(src, dst):
@@ -304,69 +2027,395 @@ def unpack_rar(src, dst):
 
 
 def unpack_rar_with_progress(src, dst, progress_callback: callable):
-  """Unpacks the given tar archive to the specified directory while
+  """Unpacks the given rar archive to the specified directory while
   providing current progress.
   """
   from rarfile import RarFile
-  _generic_unpack_with_progress(
-    src,
-    dst,
-    progress_callback,
-    RarFile,
-    'namelist',
-  )
+  _generic_unpack_with_progress(src, dst, progress_callback, RarFile)
+
+
+def _is_file_object(file) -> bool:
+  return hasattr(file, 'read') or hasattr(file, 'write')
+
+
+@contextlib.contextmanager
+def _open_tar_stream(
+  file,
+  writing: bool,
+  compression: str = None,
+  program: str | list[str] = None,
+):
+  """Opens a tar archive in streaming mode, so that `file` can be
+  a path or any file object, including pipes.
+
+  If `program` is given, then the archive is compressed or decompressed
+  by that external program, for example `pigz` or `['zstd', '-T0']`,
+  which has to accept the `-c` and `-d` flags. In that case file
+  objects need to have a file descriptor. Otherwise it is done by
+  `tarfile`, using the given `compression`: `'gz'`, `'bz2'`, `'xz'`,
+  `'zst'` or None. When reading, the compression is detected
+  automatically.
+  """
+  import subprocess
+  import tarfile
+  with contextlib.ExitStack() as stack:
+    fp = file
+    if not _is_file_object(fp):
+      fp = stack.enter_context(open(fp, 'wb' if writing else 'rb'))
+    if program is None:
+      mode = 'w|' + (compression or '') if writing else 'r|*'
+      with tarfile.open(fileobj=fp, mode=mode) as tar:
+        yield tar
+      return
+    args = [program] if isinstance(program, str) else list(program)
+    if writing:
+      fp.flush()
+      process = subprocess.Popen(
+        [*args, '-c'], stdin=subprocess.PIPE, stdout=fp,
+      )
+      pipe = process.stdin
+    else:
+      process = subprocess.Popen(
+        [*args, '-d', '-c'], stdin=fp, stdout=subprocess.PIPE,
+      )
+      pipe = process.stdout
+    error = None
+    try:
+      with tarfile.open(fileobj=pipe, mode='w|' if writing else 'r|') as tar:
+        yield tar
+    except (tarfile.TarError, BrokenPipeError) as exception:
+      # Most likely caused by the program failing
+      error = exception
+    finally:
+      pipe.close()
+      returncode = process.wait()
+    if returncode:
+      raise subprocess.CalledProcessError(returncode, process.args) from error
+    if error is not None:
+      raise error
+
+
+def pack_tar(
+  src,
+  dst,
+  compression: str = None,
+  program: str | list[str] = None,
+):
+  """Packs the given directory to a tar archive.
+
+  The `dst` can be a path or a file object, like a pipe, in which case
+  the archive is written as a stream, without seeking.
+
+  The archive is compressed using `tarfile` with the given
+  `compression`: `'gz'`, `'bz2'`, `'xz'`, `'zst'` or None. If `program`
+  is given, then that external program, for example `pigz` or
+  `['zstd', '-T0']`, is used for compression instead.
+  """
+  with _open_tar_stream(dst, True, compression, program) as tar:
+    for path, name in _get_pack_files(src):
+      tar.add(path, name, recursive=False)
+
+
+def pack_tar_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  compression: str = None,
+  program: str | list[str] = None,
+):
+  """Packs the given directory to a tar archive while providing the
+  current progress.
+
+  See `pack_tar` for the `dst`, `compression` and `program` parameters.
+  """
+  files = _get_pack_files(src)
+  n_files = len(files)
+  packed = 0
+  with _open_tar_stream(dst, True, compression, program) as tar:
+    for path, name in files:
+      progress_callback(packed, n_files)
+      tar.add(path, name, recursive=False)
+      packed += 1
+    progress_callback(packed, n_files)
+
+
+def unpack_tar(src, dst, program: str | list[str] = None):
+  """Unpacks the given tar archive to the specified directory.
+
+  The `src` can be a path or a file object, like a pipe, in which case
+  the archive is read as a stream, without seeking. The compression is
+  detected automatically, unless an external `program` is given to
+  decompress the archive, see `pack_tar`.
+  """
+  with _open_tar_stream(src, False, program=program) as tar:
+    tar.extractall(dst, filter='data')
+
+
+def unpack_tar_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  program: str | list[str] = None,
+):
+  """Unpacks the given tar archive to the specified directory while
+  providing current progress.
+
+  Since a stream has to be read to the end to know its contents, the
+  progress is the number of bytes read from `src`, out of the size of
+  `src`. If the size is not known, as is the case with pipes, then the
+  total is 0 until the end. If an external `program` is
+  used, then progress is only reported for regular files.
+
+  See `unpack_tar` for the `src` and `program` parameters.
+  """
+  with contextlib.ExitStack() as stack:
+    fp = src
+    if not _is_file_object(fp):
+      fp = stack.enter_context(open(fp, 'rb'))
+    try:
+      todo = os.fstat(fp.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+      todo = 0
+    start = fp.tell() if fp.seekable() else 0
+    total = max(todo - start, 0)
+    done = 0
+
+    def report(n_bytes: int):
+      nonlocal done
+      done += n_bytes
+      progress_callback(done, total)
+
+    if program is None:
+      fp = _ReportingReader(fp, report)
+    progress_callback(done, total)
+    with _open_tar_stream(fp, False, program=program) as tar:
+
+      def members():
+        for member in tar:
+          yield member
+          # Resumed once the member is extracted
+          if program is not None and fp.seekable():
+            # The external program shares the file's position
+            position = os.lseek(fp.fileno(), 0, os.SEEK_CUR)
+            report(position - start - done)
+
+      # Letting `extractall` set the attributes of directories once
+      # their contents are extracted
+      tar.extractall(dst, members=members(), filter='data')
+    progress_callback(done, done)
 
 
 _unpack_functions = {
   'zip': unpack_zip,
   '7z': unpack_7z,
   'rar': unpack_rar,
+  'tar': unpack_tar,
+  'gz': unpack_tar,
+  'bz2': unpack_tar,
+  'xz': unpack_tar,
+  'zst': unpack_tar,
 }
 
 _unpack_with_progress_functions = {
   'zip': unpack_zip_with_progress,
   '7z': unpack_7z_with_progress,
   'rar': unpack_rar_with_progress,
+  'tar': unpack_tar_with_progress,
+  'gz': unpack_tar_with_progress,
+  'bz2': unpack_tar_with_progress,
+  'xz': unpack_tar_with_progress,
+  'zst': unpack_tar_with_progress,
 }
 
 
+# Signatures of supported archive types: `(offset, magic bytes, type)`
+_ARCHIVE_SIGNATURES = (
+  (0, b'PK\x03\x04', 'zip'),
+  (0, b'PK\x05\x06', 'zip'),
+  (0, b'7z\xbc\xaf\x27\x1c', '7z'),
+  (0, b'Rar!\x1a\x07', 'rar'),
+  (0, b'\x1f\x8b', 'gz'),
+  (0, b'BZh', 'bz2'),
+  (0, b'\xfd7zXZ\x00', 'xz'),
+  (0, b'\x28\xb5\x2f\xfd', 'zst'),
+  (257, b'ustar', 'tar'),
+)
+_ARCHIVE_HEADER_SIZE = max(
+  offset + len(magic) for offset, magic, _ in _ARCHIVE_SIGNATURES
+)
+# Compressed files are only archives if they contain a tar archive
+_TAR_COMPRESSIONS = ('gz', 'bz2', 'xz', 'zst')
+_TAR_MAGIC = b'ustar'
+_TAR_MAGIC_OFFSET = 257
+
+
+def _read_decompressed(path: str, compression: str, size: int) -> bytes:
+  """Returns up to `size` bytes from the start of the given compressed
+  file after decompressing them, or None if it can't be decompressed,
+  including when Python was built without support for the compression.
+  """
+  if compression == 'gz':
+    import gzip as module
+    errors = (EOFError, OSError)
+  elif compression == 'bz2':
+    import bz2 as module
+    errors = (EOFError, OSError)
+  elif compression == 'xz':
+    import lzma as module
+    errors = (EOFError, OSError, module.LZMAError)
+  else:
+    try:
+      from compression import zstd as module
+    except ImportError:
+      return None
+    errors = (EOFError, OSError, module.ZstdError)
+  try:
+    with module.open(path, 'rb') as fp:
+      return fp.read(size)
+  except errors:
+    return None
+
+
+@functools.lru_cache(maxsize=65536)
+def _detect_archive_type(path: str, size: int, mtime: int) -> str | None:
+  """Returns the type of the given archive by its magic bytes.
+
+  Compressed files are only recognised if they contain a tar archive,
+  which requires decompressing the start of the file.
+
+  The `size` and `mtime` of the file are only a part of the cache key,
+  so that files are inspected again after they change.
+  """
+  with open(path, 'rb') as fp:
+    header = fp.read(_ARCHIVE_HEADER_SIZE)
+  for offset, magic, archive_type in _ARCHIVE_SIGNATURES:
+    if not header.startswith(magic, offset):
+      continue
+    if archive_type in _TAR_COMPRESSIONS:
+      header = _read_decompressed(path, archive_type, _ARCHIVE_HEADER_SIZE)
+      if not header or not header.startswith(_TAR_MAGIC, _TAR_MAGIC_OFFSET):
+        return None
+    return archive_type
+  return None
+
+
+def get_archive_type(archive) -> str | None:
+  """Returns the type of the given archive as a file extension, like
+  `'zip'` or `'7z'`, or None if it's not a supported archive.
+
+  Only the few bytes needed to recognise supported archive types are
+  read, and results are cached until the file's size or modification
+  time changes.
+
+  Directories and other files that aren't regular files are not
+  archives, any other `OSError`, like `FileNotFoundError`, is raised.
+  """
+  import stat as stat_module
+  path = os.fspath(archive)
+  stat = os.stat(path)
+  if not stat_module.S_ISREG(stat.st_mode):
+    return None
+  return _detect_archive_type(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _get_archive_type_or_none(archive) -> str | None:
+  """Returns the type of the given archive, or None if it can't be
+  inspected, see `get_archive_type`.
+  """
+  try:
+    return get_archive_type(archive)
+  except OSError:
+    return None
+
+
+def get_archive_types(archives, workers: int = 8) -> dict:
+  """Returns a dictionary where each of the given files points to its
+  archive type, see `get_archive_type`.
+
+  Files that can't be inspected, for example because they were removed
+  in the meantime, point to None, so that they don't stop the others
+  from being inspected.
+
+  Files are inspected concurrently by a pool of `workers` threads.
+  """
+  archives = list(archives)
+  if workers <= 1 or len(archives) <= 1:
+    return {
+      archive: _get_archive_type_or_none(archive) for archive in archives
+    }
+  from concurrent.futures import ThreadPoolExecutor
+  with ThreadPoolExecutor(workers) as executor:
+    archive_types = executor.map(_get_archive_type_or_none, archives)
+    return dict(zip(archives, archive_types))
+
+
 def can_unpack(archive) -> bool:
   """Checks if the given archive can be unpacked."""
-  ext = filetype.guess_extension(archive)
-  function = _unpack_functions.get(ext)
-  return function is not None
+  return get_archive_type(archive) in _unpack_functions
 
 
-def unpack(src, dst):
-  """Unpacks the given archive to the specified directory.
+def _get_archive_type(src) -> str:
+  """Returns the type of the given archive, as a file extension.
 
-  If the archive type is not supported `NotImplementedError` is raised.
+  File objects, like pipes, can not be inspected without consuming them,
+  so they are always treated as tar streams. Errors accessing the file,
+  like `FileNotFoundError`, are raised as they are.
+
+  If the archive type can't be determined `NotImplementedError` is
+  raised.
   """
-  ext = filetype.guess_extension(src)
+  if _is_file_object(src):
+    return 'tar'
+  ext = get_archive_type(src)
   if not ext:
     raise NotImplementedError(
-      f"Unable to determine file extension of {src}"
+      f"Unable to determine archive type of {src}"
     )
+  return ext
+
+
+def unpack(src, dst, workers: int = 1):
+  """Unpacks the given archive to the specified directory.
+
+  If `src` is a file object, like a pipe, then it's unpacked as a tar
+  stream, see `unpack_tar`.
+
+  The `workers` parameter is passed on to `unpack_zip` when unpacking
+  zip archives, other archive types are always unpacked by the calling
+  thread.
+
+  If the archive type is not supported `NotImplementedError` is raised.
+  """
+  ext = _get_archive_type(src)
   function = _unpack_functions.get(ext)
   if not function:
     raise NotImplementedError(
       f"Unsupported archive type '{ext}'"
     )
-  function(src, dst)
+  if ext == 'zip':
+    function(src, dst, workers)
+  else:
+    function(src, dst)
 
 
-def unpack_with_progress(src, dst, progress_callback: callable):
+def unpack_with_progress(
+  src,
+  dst,
+  progress_callback: callable,
+  workers: int = 1,
+):
   """Unpacks the given archive to the specified directory while providing
   current progress.
 
+  See `unpack` for the `src` and `workers` parameters.
+
   If the archive type is not supported `NotImplementedError` is raised.
   """
-  ext = filetype.guess_extension(src)
-  if not ext:
-    raise ValueError(
-      f"Unable to determine file extension of {src}"
-    )
+  ext = _get_archive_type(src)
   function = _unpack_with_progress_functions.get(ext)
   if not function:
     raise NotImplementedError(f"Unsupported filetype {ext}")
-  function(src, dst, progress_callback)
+  if ext == 'zip':
+    function(src, dst, progress_callback, workers)
+  else:
+    function(src, dst, progress_callback)
@@ -1,22 +1,28 @@
 """Used for getting user input inside the terminal."""
 
-# Importing readline if available for a better input() experience
-try:
-  import readline as readline
-except ModuleNotFoundError:
-  pass
-
 # Internal imports
 from . import writer
 
 
+def _input(prompt: str) -> str:
+  """Like `input`, but imports readline if available, for a better
+  input experience. The import is deferred until input is actually
+  needed, since it noticeably slows down program startup.
+  """
+  try:
+    import readline as readline
+  except ModuleNotFoundError:
+    pass
+  return input(prompt)
+
+
 def ask(prompt: str, prompt_style: callable = None) -> bool:
   """Asks the user a yes/no question."""
   prompt = f'{prompt} [y/n]: '
   if prompt_style:
     prompt = prompt_style(prompt)
   while True:
-    user_input = input(prompt).strip().lower()
+    user_input = _input(prompt).strip().lower()
     if user_input in ('y', 'yes'):
       return True
     elif user_input in ('n', 'no'):
@@ -40,7 +46,7 @@ def select(
   print(items + '\n')
   # Getting user input
   while True:
-    choice = input(prompt).strip()
+    choice = _input(prompt).strip()
     if choice == '0':
       return None
     elif choice in [str(n) for n in range(1, n_items + 1)]:
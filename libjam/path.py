@@ -20,15 +20,32 @@ class Path(pathlib.Path):
   added for convenience.
   """
 
-  def copy_with_progress(self, target, progress_callback: callable):
+  def copy_with_progress(
+    self,
+    target,
+    progress_callback: callable,
+    workers: int = 1,
+    strategy: str = 'reflink',
+    resume: bool = False,
+    checksum: str = None,
+  ) -> str | dict[str, str] | None:
     """Recursively copy this file or directory tree to the given
     destination while providing current progress.
+
+    The `workers` parameter only affects directory trees, see
+    `drawer.copy_tree_with_progress`. For the `strategy`, `resume` and
+    `checksum` parameters see `drawer.copy_with_progress`. If a
+    `checksum` is given, then a file's digest, or a directory's
+    manifest of digests, is returned.
     """
     if self.is_dir():
-      function = drawer.copy_tree_with_progress
-    else:
-      function = drawer.copy_with_progress
-    function(self, target, progress_callback)
+      return drawer.copy_tree_with_progress(
+        self, target, progress_callback, workers, strategy, resume,
+        checksum,
+      )
+    return drawer.copy_with_progress(
+      self, target, progress_callback, strategy, resume, checksum,
+    )
 
   get_tree_size = drawer.get_tree_size
   to_readable_size = staticmethod(drawer.to_readable_size)
@@ -51,6 +68,12 @@ class Path(pathlib.Path):
   unpack_rar = drawer.unpack_rar
   unpack_rar_with_progress = drawer.unpack_rar_with_progress
 
+  pack_tar = drawer.pack_tar
+  pack_tar_with_progress = drawer.pack_tar_with_progress
+  unpack_tar = drawer.unpack_tar
+  unpack_tar_with_progress = drawer.unpack_tar_with_progress
+
+  get_archive_type = drawer.get_archive_type
   can_unpack = drawer.can_unpack
   unpack = drawer.unpack
   unpack_with_progress = drawer.unpack_with_progress
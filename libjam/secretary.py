@@ -2,9 +2,7 @@
 from copy import deepcopy
 import os
 import sys
-import tomllib
 import collections
-import platformdirs
 
 
 def _merge_dicts(src: dict, dst: dict) -> dict:
@@ -38,6 +36,7 @@ class File(collections.UserDict):
 
   def load(self):
     """Updates the config."""
+    import tomllib
     if self.exit_on_error:
       try:
         data = self._load()
@@ -50,6 +49,7 @@ class File(collections.UserDict):
     self.data = _merge_dicts(data, deepcopy(self.defaults))
 
   def _load(self) -> dict:
+    import tomllib
     if self.ensure_exists:
       if not os.path.isfile(self.file):
         with open(self.file, 'w') as fp:
@@ -91,6 +91,7 @@ class Secretary:
     roaming: bool = False,
     ensure_exists: bool = False,
   ):
+    import platformdirs
     self.directory = platformdirs.user_config_dir(
       program, author, version, roaming, ensure_exists,
     )
@@ -3,6 +3,8 @@
 # Imports
 import os
 import sys
+import time
+import signal
 import contextlib
 import collections
 
@@ -40,6 +42,56 @@ def indent(string: str, prefix: str = '  ') -> str:
   return prefix + string.replace('\n', '\n' + prefix)
 
 
+class _TerminalWidth:
+  """Caches the width of the terminal, resetting it on SIGWINCH."""
+
+  def __init__(self):
+    self.width = None
+    self.watching = None
+    self._handler = None
+
+  def _on_resize(self, signum, frame, previous_handler=None):
+    self.width = None
+    if callable(previous_handler):
+      previous_handler(signum, frame)
+
+  def _watch(self) -> bool:
+    """Installs a SIGWINCH handler, returning whether it's installed."""
+    if self.watching is None:
+      self.watching = False
+      sigwinch = getattr(signal, 'SIGWINCH', None)
+      if sigwinch is not None:
+        try:
+          previous_handler = signal.getsignal(sigwinch)
+          self._handler = lambda signum, frame: self._on_resize(
+            signum, frame, previous_handler,
+          )
+          signal.signal(sigwinch, self._handler)
+          self.watching = True
+        except ValueError:
+          # Signal handlers can only be installed from the main thread
+          pass
+    if self.watching and signal.getsignal(signal.SIGWINCH) is not self._handler:
+      # The application replaced the handler, so resizes go unnoticed
+      self.watching = False
+      self.width = None
+    return self.watching
+
+  def get(self) -> int:
+    """Returns the width of the terminal, which is cached where it's
+    possible to tell when the terminal is resized.
+    """
+    if self.width is not None and self._watch():
+      return self.width
+    width = os.get_terminal_size()[0]
+    if self._watch():
+      self.width = width
+    return width
+
+
+_terminal_width = _TerminalWidth()
+
+
 def to_columns(
   items: list[str],
   n_columns: int = 0,
@@ -56,7 +108,7 @@ def to_columns(
   n_items = len(items)
   # Calculating n_columns
   if not n_columns:
-    available_width = os.get_terminal_size()[0] - len(prefix)
+    available_width = _terminal_width.get() - len(prefix)
     n_columns = 1
     for i in range(2, n_items + 2):
       selected_items = items_by_len[:i]
@@ -199,6 +251,10 @@ class StatusBar:
   a part of it will be printed, so that it fits cleanly onto one line
   in the user's terminal, maintaining the appearance of a bar.
 
+  The bar is only redrawn when its contents change. If `max_fps` is
+  set, then it's also redrawn at most `max_fps` times per second, unless
+  `update` is called with `force` set to True.
+
   Usage example:
   ```
   with StatusBar('Configuring Foo...') as status:
@@ -208,22 +264,36 @@ class StatusBar:
   ```
   """
 
-  def __init__(self, status: str):
+  def __init__(self, status: str, max_fps: float = None):
     self.status = status
+    self.max_fps = max_fps
+    self._frame = None
+    self._frame_time = 0
 
   def _build(self):
-    term_width = os.get_terminal_size()[0]
+    term_width = _terminal_width.get()
     return clear_page_from_cursor + self.status[:term_width] + '\r'
 
-  def update(self, status: str = None):
+  def update(self, status: str = None, force: bool = False):
     """Updates the status bar."""
     if status is not None:
       self.status = status
-    eprint(self._build(), True)
+    now = time.monotonic()
+    throttled = self.max_fps and not force
+    if throttled and now - self._frame_time < 1 / self.max_fps:
+      return
+    self._frame_time = now
+    frame = self._build()
+    if frame == self._frame:
+      return
+    self._frame = frame
+    eprint(frame, True)
 
   def __enter__(self):
     hide_input()
-    eprint(hide_cursor + self._build(), True)
+    self._frame = self._build()
+    self._frame_time = time.monotonic()
+    eprint(hide_cursor + self._frame, True)
     return self
 
   def __exit__(self, *exc):
@@ -239,6 +309,11 @@ class ProgressBar:
   a part of it will be printed, so that it fits cleanly onto one line
   in the user's terminal, maintaining the appearance of a bar.
 
+  The bar is redrawn at most `max_fps` times per second, and only when
+  its contents change, so `update` can be called from tight loops.
+  Calling `update` with `force` set to True draws it regardless, for
+  example for the final update.
+
   Example usage:
   ```
   with ProgressBar('Fooing 3 Bars', 0, 3) as progress_bar:
@@ -254,11 +329,14 @@ class ProgressBar:
     done: int = 0,
     todo: int = 0,
     symbols: str = '[= ]',
+    max_fps: float = 30,
   ):
     self.status = status
     self.symbols = symbols
+    self.max_fps = max_fps
     self._done = done
     self._todo = todo
+    self._frame_time = 0
     self._bar = StatusBar(self._build())
 
   def _build(self) -> str:
@@ -268,7 +346,7 @@ class ProgressBar:
       progress_float = min(max(progress_float, 0), 1)
     except ZeroDivisionError:
       progress_float = 0
-    available_width = os.get_terminal_size()[0]
+    available_width = _terminal_width.get()
     items = []
     # Printing the status
     items.append(self.status)
@@ -296,13 +374,18 @@ class ProgressBar:
     items[0] += ' ' * available_width
     return ''.join(items)
 
-  def update(self, done: int = None, todo: int = None):
+  def update(self, done: int = None, todo: int = None, force: bool = False):
     """Updates the progress bar."""
     if done is not None:
       self._done = done
     if todo is not None:
       self._todo = todo
-    self._bar.update(self._build())
+    now = time.monotonic()
+    throttled = self.max_fps and not force
+    if throttled and now - self._frame_time < 1 / self.max_fps:
+      return
+    self._frame_time = now
+    self._bar.update(self._build(), force=True)
 
   def __enter__(self):
     self._bar.__enter__()
@@ -0,0 +1,52 @@
+"""Tests that importing libjam stays cheap, see `libjam/__init__.py`."""
+
+# Imports
+import os
+import sys
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules which programs only pay for once they use the parts of libjam
+# that need them
+HEAVY_MODULES = (
+  'platformdirs', 'filetype', 'readline', 'asyncio', 'subprocess', 'tomllib',
+)
+
+
+def get_imported_modules(code: str) -> set[str]:
+  """Runs the given code in a fresh interpreter and returns the names of
+  the modules that were imported by the end of it.
+  """
+  code += '\nimport sys\nprint(*sys.modules)'
+  result = subprocess.run(
+    [sys.executable, '-c', code],
+    cwd=ROOT, capture_output=True, text=True, check=True,
+  )
+  return set(result.stdout.split())
+
+
+class TestImportTime(unittest.TestCase):
+
+  def test_import_is_lazy(self):
+    modules = get_imported_modules('import libjam')
+    for name in HEAVY_MODULES:
+      self.assertNotIn(name, modules)
+    submodules = [name for name in modules if name.startswith('libjam.')]
+    self.assertEqual(submodules, [])
+
+  def test_captain_is_lazy(self):
+    modules = get_imported_modules('from libjam import Captain')
+    self.assertIn('libjam.captain', modules)
+    for name in HEAVY_MODULES:
+      self.assertNotIn(name, modules)
+    self.assertNotIn('libjam.drawer', modules)
+
+  def test_submodules_load_on_access(self):
+    modules = get_imported_modules('import libjam; libjam.drawer')
+    self.assertIn('libjam.drawer', modules)
+
+
+if __name__ == '__main__':
+  unittest.main()